@@ -1,6 +1,9 @@
 import Tablesort from "tablesort";
 
+import { markTakenSeats } from "./seat-map";
+
 document.addEventListener("DOMContentLoaded", () => {
+  markTakenSeats();
   document.querySelectorAll("[data-tablesort]").forEach((el) => {
     Tablesort(el, {});
   });
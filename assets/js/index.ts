@@ -2,6 +2,7 @@ import { setupBookingOverview } from "./booking";
 import { initSentry } from "./errors";
 import "./number-input";
 import { setupPayment } from "./payment";
+import { markTakenSeats } from "./seat-map";
 import { setupSelectSeats } from "./seats";
 
 declare global {
@@ -17,6 +18,7 @@ declare global {
 
 document.addEventListener("DOMContentLoaded", () => {
   initSentry();
+  markTakenSeats();
 
   const { config } = window;
   if (config) {
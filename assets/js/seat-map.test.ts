@@ -0,0 +1,20 @@
+import { expect, it } from "vitest";
+
+import { markTakenSeats } from "./seat-map";
+
+it("Marks taken seats in the seat map", () => {
+  document.body.innerHTML = `
+    <span data-taken-seats="1,3">
+      <svg>
+        <circle class="seat" id="seat-1" />
+        <circle class="seat" id="seat-2" />
+        <circle class="seat" id="seat-3" />
+      </svg>
+    </span>`;
+
+  markTakenSeats();
+
+  expect(document.getElementById("seat-1")!.getAttribute("class")).to.equal("seat taken-seat");
+  expect(document.getElementById("seat-2")!.getAttribute("class")).to.equal("seat");
+  expect(document.getElementById("seat-3")!.getAttribute("class")).to.equal("seat taken-seat");
+});
@@ -0,0 +1,13 @@
+// The seat map SVG is cached per venue, so the taken seats of the show are
+// sent separately and marked here before any click handlers are set up.
+export function markTakenSeats() {
+  document.querySelectorAll<HTMLElement>("[data-taken-seats]").forEach((elm) => {
+    const takenSeats = (elm.dataset.takenSeats || "").split(",").filter(Boolean);
+    for (let seatId of takenSeats) {
+      const seat = document.getElementById("seat-" + seatId);
+      if (seat) {
+        seat.setAttribute("class", seat.getAttribute("class") + " taken-seat");
+      }
+    }
+  });
+}
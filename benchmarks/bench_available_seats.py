@@ -0,0 +1,73 @@
+"""
+Latency of seat availability lookups for differently sized venues
+
+These are not part of the regular test suite. Run them with:
+
+    pytest benchmarks/bench_available_seats.py -s
+"""
+from __future__ import annotations
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from benchmarks.utils import measure, report
+from factories import factories as f
+from karspexet.ticket.models import Reservation, Ticket
+from karspexet.venue.models import Seat
+
+OPEN_RESERVATIONS = 300
+SEATS_PER_RESERVATION = 4
+
+
+def build_show(num_seats: int):
+    """
+    A show where half of the venue is sold and a few hundred carts are open
+    """
+    show = f.CreateShow()
+    group = f.CreateSeatingGroup(venue=show.venue)
+    Seat.objects.bulk_create(Seat(group=group, name=f"Plats {i}", x_pos=0, y_pos=0) for i in range(num_seats))
+    seat_ids = list(Seat.objects.filter(group=group).values_list("id", flat=True))
+
+    sold, rest = seat_ids[: num_seats // 2], seat_ids[num_seats // 2:]
+    account = f.CreateAccount()
+    Ticket.objects.bulk_create(Ticket(show=show, seat_id=seat_id, account=account, price=200) for seat_id in sold)
+
+    timeout = timezone.now() + timezone.timedelta(minutes=30)
+    Reservation.objects.bulk_create(
+        Reservation(
+            show=show,
+            ticket_price=0,
+            total=0,
+            session_timeout=timeout,
+            tickets={str(seat_id): "normal" for seat_id in rest[i: i + SEATS_PER_RESERVATION]},
+        )
+        for i in range(0, min(len(rest), OPEN_RESERVATIONS * SEATS_PER_RESERVATION), SEATS_PER_RESERVATION)
+    )
+
+    # Give the planner the same statistics it would have in production
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return show
+
+
+def legacy_available_seats(show) -> list[Seat]:
+    # The implementation before availability moved into a single statement, kept for comparison
+    taken_seats = set(show.ticket_set.values_list("seat_id", flat=True))
+    reserved_seats = show.reservation_set(manager="active").values_list("tickets", flat=True)
+    for tickets in reserved_seats:
+        taken_seats.update(map(int, tickets.keys()))
+    return list(Seat.objects.filter(group__venue=show.venue).exclude(id__in=taken_seats))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("num_seats", [500, 2_000, 10_000])
+def test_available_seats(num_seats):
+    show = build_show(num_seats)
+
+    expected = {seat.id for seat in legacy_available_seats(show)}
+    assert set(Seat.objects.available_seat_ids(show)) == expected
+
+    report(f"legacy available_seats ({num_seats})", measure(lambda: legacy_available_seats(show)))
+    report(f"available_seats ({num_seats})", measure(lambda: Seat.objects.available_seats(show)))
+    report(f"available_seat_ids ({num_seats})", measure(lambda: Seat.objects.available_seat_ids(show)))
@@ -0,0 +1,189 @@
+"""
+Concurrent customers going through the booking funnel, like on the morning tickets are released
+
+Every customer opens the seat map, holds a few of the seats that looked free when the page was
+loaded, looks at the booking overview and pays with the fake payment process. Customers who lose
+a seat to someone else try again with other seats a few times before giving up.
+
+The customers are threads in the same process as the server, so the numbers are lower than with a
+real server with several workers. They are meant for comparing changes, not for capacity planning.
+
+These are not part of the regular test suite. Run them with:
+
+    pytest benchmarks/bench_booking_funnel.py -s
+
+The load can be tuned with environment variables:
+
+    BENCH_CUSTOMERS             number of customers per run (200)
+    BENCH_SEATS_PER_CUSTOMER    seats every customer wants (2)
+    BENCH_VENUE_CSV             a seat layout in the format of build_seats, instead of a generated one
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import Client
+from django.utils import timezone
+
+from benchmarks.utils import percentiles, report
+from factories import factories as f
+from karspexet.ticket.models import Reservation, Ticket
+from karspexet.venue.models import Seat, SeatingGroup
+
+CUSTOMERS = int(os.environ.get("BENCH_CUSTOMERS", 200))
+SEATS_PER_CUSTOMER = int(os.environ.get("BENCH_SEATS_PER_CUSTOMER", 2))
+VENUE_CSV = os.environ.get("BENCH_VENUE_CSV")
+
+SEATS_PER_ROW = 20
+ROWS_PER_GROUP = 10
+HOLD_ATTEMPTS = 3
+
+
+def write_venue_csv(path, num_seats: int) -> str:
+    """
+    A seat layout for build_seats, with rows of seats split into sections
+    """
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        for i in range(num_seats):
+            row, number = divmod(i, SEATS_PER_ROW)
+            group = f"Sektion {row // ROWS_PER_GROUP + 1}"
+            writer.writerow([group, number * 30, row * 30, f"Rad {row + 1} plats {number + 1}"])
+    return str(path)
+
+
+def build_show(layout: str):
+    venue = f.CreateVenue()
+    call_command("build_seats", str(venue.id), layout, stdout=open(os.devnull, "w"))
+    for group in SeatingGroup.objects.filter(venue=venue):
+        f.CreatePricingModel(
+            seating_group=group,
+            prices={"student": 200, "normal": 250},
+            valid_from=timezone.now() - timezone.timedelta(days=1),
+        )
+    return f.CreateShow(venue=venue, date=timezone.now() + timezone.timedelta(days=14), visible=True)
+
+
+class Customer:
+    def __init__(self, show, number: int):
+        self.show = show
+        self.number = number
+        self.client = Client(raise_request_exception=False)
+        self.rng = random.Random(number)
+        self.timings: list[tuple[str, float]] = []
+        self.conflicts = 0
+        self.error = ""
+
+    def request(self, step: str, method: str, url: str, data=None):
+        start = time.perf_counter()
+        response = getattr(self.client, method)(url, data)
+        self.timings.append((step, (time.perf_counter() - start) * 1000))
+        if response.status_code >= 500:
+            reason = repr(response.exc_info[1]) if response.exc_info else response.status_code
+            self.error = f"{step}: {reason}"
+        return response
+
+    def book(self) -> str:
+        try:
+            return self._book()
+        finally:
+            # Every customer runs in a thread of its own, with a connection of its own
+            connection.close()
+
+    def _book(self) -> str:
+        select_seats_url = reverse("select_seats", args=[self.show.id])
+        if self.request("select_seats", "get", select_seats_url).status_code != 200:
+            return "error"
+
+        for _ in range(HOLD_ATTEMPTS):
+            # The seats shown as free on the seat map, which may be gone by the time we submit
+            available = list(Seat.objects.available_seat_ids(self.show))
+            if len(available) < SEATS_PER_CUSTOMER:
+                return "sold out"
+            data = {f"seat_{seat_id}": "normal" for seat_id in self.rng.sample(available, SEATS_PER_CUSTOMER)}
+            data["email"] = f"kund{self.number}@example.com"
+
+            response = self.request("hold_seats", "post", select_seats_url, data)
+            if response.status_code == 302:
+                break
+            if response.status_code != 200:
+                return "error"
+            self.conflicts += 1
+        else:
+            return "gave up"
+
+        response = self.request("booking_overview", "get", reverse("booking_overview", args=[self.show.id]))
+        if response.status_code != 200:
+            return "error"
+
+        reservation_id = self.client.session[f"show_{self.show.id}"]
+        billing = {"name": f"Kund {self.number}", "email": f"kund{self.number}@example.com", "phone": ""}
+        response = self.request("process_payment", "post", reverse("process_payment", args=[reservation_id]), billing)
+        if response.status_code != 302:
+            # The seats were held, but somebody else was issued tickets for them
+            return "double booked"
+        return "booked"
+
+
+def double_booked_seats(show) -> list[str]:
+    holders = Counter()
+    for tickets in Reservation.objects.filter(show=show, finalized=True).values_list("tickets", flat=True):
+        holders.update(tickets.keys())
+    return [seat_id for seat_id, count in holders.items() if count > 1]
+
+
+@pytest.fixture
+def quiet_logs():
+    # The request metrics and queued emails of thousands of requests would drown the report
+    logging.disable(logging.INFO)
+    yield
+    logging.disable(logging.NOTSET)
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("concurrency", [1, 10, 25])
+def test_booking_funnel(concurrency, settings, tmp_path, quiet_logs):
+    settings.PAYMENT_PROCESS = "fake"
+    # Leave some seats unsold, so the last customers still compete for seats instead of finding none
+    layout = VENUE_CSV or write_venue_csv(tmp_path / "venue.csv", int(CUSTOMERS * SEATS_PER_CUSTOMER * 1.25))
+    show = build_show(layout)
+    customers = [Customer(show, number) for number in range(CUSTOMERS)]
+    # The first request after a deploy fills caches of the CMS, which is not what we want to measure
+    Client().get(reverse("select_seats", args=[show.id]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = Counter(executor.map(Customer.book, customers))
+    elapsed = time.perf_counter() - start
+
+    timings = defaultdict(list)
+    for customer in customers:
+        for step, duration in customer.timings:
+            timings[step].append(duration)
+
+    print()
+    for step in ("select_seats", "hold_seats", "booking_overview", "process_payment"):
+        report(f"{step} ({concurrency} concurrent)", percentiles(timings[step]))
+    requests = sum(len(customer.timings) for customer in customers)
+    print(
+        f"{outcomes['booked']} bookings in {elapsed:.1f}s: {outcomes['booked'] / elapsed:.1f} bookings/s, "
+        f"{requests / elapsed:.1f} requests/s, {sum(c.conflicts for c in customers)} seat conflicts, "
+        f"outcomes {dict(outcomes)}"
+    )
+    for error in sorted({customer.error for customer in customers if customer.error}):
+        print(f"  {error}")
+
+    assert not double_booked_seats(show)
+    assert outcomes["double booked"] == 0
+    assert outcomes["error"] == 0
+    assert Ticket.objects.filter(show=show).count() == outcomes["booked"] * SEATS_PER_CUSTOMER
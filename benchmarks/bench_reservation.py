@@ -0,0 +1,110 @@
+"""
+Latency of the functions behind the seat selection and booking overview pages
+
+Every function is measured for venues of different sizes, with a varying number of other
+customers holding seats at the same time. Half of the seats that are not held are sold.
+
+These are not part of the regular test suite. Run them with:
+
+    pytest benchmarks/bench_reservation.py -s
+
+Each result is compared with the baseline stored by an earlier run with BENCH_SAVE_BASELINE=1.
+"""
+from __future__ import annotations
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from benchmarks.utils import measure, report_against_baseline
+from factories import factories as f
+from karspexet.show.models import Show
+from karspexet.ticket.helpers import build_pricings_and_seats, get_used_seats
+from karspexet.ticket.models import Reservation, ReservationSeat, Ticket
+from karspexet.venue.models import Seat
+
+SEATS_PER_GROUP = 250
+SEATS_PER_RESERVATION = 4
+# The size of the reservation being measured, a group booking
+MEASURED_SEATS = 8
+
+
+def build_show(num_seats: int, num_reservations: int):
+    show = f.CreateShow()
+    for start in range(0, num_seats, SEATS_PER_GROUP):
+        group = f.CreateSeatingGroup(venue=show.venue, name=f"Sektion {start // SEATS_PER_GROUP + 1}")
+        f.CreatePricingModel(
+            seating_group=group,
+            prices={"student": 200, "normal": 250},
+            valid_from=timezone.now() - timezone.timedelta(days=1),
+        )
+        Seat.objects.bulk_create(
+            Seat(group=group, name=f"Plats {i}", x_pos=0, y_pos=0)
+            for i in range(start, min(num_seats, start + SEATS_PER_GROUP))
+        )
+    seat_ids = list(Seat.objects.filter(group__venue=show.venue).order_by("id").values_list("id", flat=True))
+
+    num_held = num_reservations * SEATS_PER_RESERVATION
+    held, rest = seat_ids[:num_held], seat_ids[num_held:]
+    timeout = timezone.now() + timezone.timedelta(minutes=30)
+    reservations = Reservation.objects.bulk_create(
+        Reservation(
+            show=show,
+            ticket_price=0,
+            total=0,
+            session_timeout=timeout,
+            tickets={str(seat_id): "normal" for seat_id in held[i: i + SEATS_PER_RESERVATION]},
+        )
+        for i in range(0, len(held), SEATS_PER_RESERVATION)
+    )
+    ReservationSeat.objects.bulk_create(
+        ReservationSeat(reservation=reservation, show=show, seat_id=int(seat_id), ticket_type=ticket_type)
+        for reservation in reservations
+        for seat_id, ticket_type in reservation.tickets.items()
+    )
+
+    account = f.CreateAccount()
+    sold = rest[len(rest) // 2:]
+    Ticket.objects.bulk_create(Ticket(show=show, seat_id=seat_id, account=account, price=250) for seat_id in sold)
+
+    # Give the planner the same statistics it would have in production
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    return show
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("num_reservations", [0, 100, 400])
+@pytest.mark.parametrize("num_seats", [500, 2_000, 5_000])
+def test_reservation_functions(num_seats, num_reservations):
+    if num_reservations * SEATS_PER_RESERVATION > num_seats // 2:
+        pytest.skip("More held seats than the venue has room for")
+
+    show = build_show(num_seats, num_reservations)
+    free_seats = Seat.objects.available_seats(show)
+    reservation = f.CreateReservation(show=show, tickets={})
+    reservation.build_tickets({
+        "normal": free_seats[:MEASURED_SEATS // 2],
+        "student": free_seats[MEASURED_SEATS // 2:MEASURED_SEATS],
+    })
+    reservation.save()
+
+    def coverage():
+        return list(Show.objects.filter(pk=show.pk).annotate_ticket_coverage())
+
+    def used_seats():
+        # A fresh instance, so the show and venue are fetched like in a request
+        return get_used_seats(Reservation.objects.get(pk=reservation.pk))
+
+    benchmarks = {
+        "calculate_ticket_price_and_total": reservation.calculate_ticket_price_and_total,
+        # Picking every free seat, like a free seating show does for a large enough order
+        "build_tickets": lambda: Reservation(show=show).build_tickets({"normal": free_seats}),
+        "available_seats": lambda: Seat.objects.available_seats(show),
+        "build_pricings_and_seats": lambda: build_pricings_and_seats(show.venue),
+        "get_used_seats": used_seats,
+        "annotate_ticket_coverage": coverage,
+    }
+    print()
+    for name, fn in benchmarks.items():
+        report_against_baseline(f"{name} ({num_seats} seats, {num_reservations} held)", measure(fn))
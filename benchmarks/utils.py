@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+import json
+import os
+import statistics
+import time
+from typing import Callable
+
+# Timings are only comparable on the same machine, so the baselines are not committed
+BASELINE_FILE = os.environ.get("BENCH_BASELINE", os.path.join(os.path.dirname(__file__), "baselines.json"))
+SAVE_BASELINE = os.environ.get("BENCH_SAVE_BASELINE", "").lower() in ("1", "true")
+
+
+def measure(fn: Callable, rounds: int = 20) -> dict[str, float]:
+    """
+    Call `fn` `rounds` times and return timing statistics in milliseconds
+    """
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    timings.sort()
+    return {
+        "min": timings[0],
+        "median": statistics.median(timings),
+        "p95": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "max": timings[-1],
+    }
+
+
+def percentiles(timings: list[float]) -> dict[str, float]:
+    """
+    The latency percentiles of a list of timings in milliseconds
+    """
+    timings = sorted(timings)
+    if not timings:
+        return {}
+
+    def at(fraction: float) -> float:
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+    return {"p50": at(0.50), "p95": at(0.95), "p99": at(0.99), "max": timings[-1]}
+
+
+def report(name: str, stats: dict[str, float]) -> None:
+    summary = "  ".join(f"{key}={value:8.2f}ms" for key, value in stats.items())
+    print(f"{name:<40} {summary}")
+
+
+def _load_baselines() -> dict[str, dict[str, float]]:
+    try:
+        with open(BASELINE_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def report_against_baseline(name: str, stats: dict[str, float]) -> None:
+    """
+    Report `stats` along with the change of the median since the stored baseline of `name`
+
+    Run with BENCH_SAVE_BASELINE=1 to store the current numbers as the new baseline.
+    """
+    baselines = _load_baselines()
+    baseline = baselines.get(name)
+
+    summary = "  ".join(f"{key}={value:8.2f}ms" for key, value in stats.items())
+    if baseline:
+        change = (stats["median"] - baseline["median"]) / baseline["median"] * 100
+        summary += f"  {change:+7.1f}% vs baseline"
+    print(f"{name:<60} {summary}")
+
+    if SAVE_BASELINE:
+        baselines[name] = stats
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(settings, tmp_path):
+    # Keep files generated during tests out of the project's cache directory
+    settings.CACHE_DIR = str(tmp_path)
+    settings.SEAT_MAP_CACHE_DIR = str(tmp_path / "seat_maps")
+    settings.TICKET_PDF_CACHE_DIR = str(tmp_path / "ticket_pdfs")
+    settings.QR_CODE_CACHE_DIR = str(tmp_path / "qr_codes")
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Asserts that a response ran at most `budget` queries, as counted by RequestMetricsMiddleware
+    """
+    def check(response, budget: int):
+        queries = response.metrics.queries
+        assert queries <= budget, f"{response.request['PATH_INFO']} ran {queries} queries, its budget is {budget}"
+
+    return check
@@ -10,5 +10,6 @@ set -xe
   --network=host \
   --mount type=bind,source=/var/spool/postfix,target=/var/spool/postfix \
   -v /srv/karspexet/shared/uploads:/app/uploads \
+  -v /srv/karspexet/shared/cache:/app/cache \
   ghcr.io/karspexet/karspexet \
   gunicorn karspexet.wsgi --bind 0.0.0.0:8001
@@ -0,0 +1,54 @@
+import pytest
+from django.shortcuts import reverse
+
+from factories import factories as f
+from karspexet.venue.models import Seat
+
+# The budgets must not depend on the number of shows, tickets or vouchers, so every view is
+# exercised with a small and a large amount of them
+pytestmark = [pytest.mark.django_db, pytest.mark.parametrize("num_shows", [1, 10])]
+
+
+@pytest.fixture
+def show(num_shows):
+    venue = f.CreateVenue(num_seats=num_shows * 2)
+    seats = list(Seat.objects.filter(group__venue=venue))
+    shows = [f.CreateShow(venue=venue) for _ in range(num_shows)]
+    for show in shows:
+        for i, seat in enumerate(seats):
+            reservation = f.CreateReservation(show=show, tickets={str(seat.id): "normal"}, finalized=True)
+            f.CreateTicket(show=show, seat=seat, reservation=reservation, ticket_type=["normal", "student"][i % 2])
+            f.CreateDiscount(reservation=reservation)
+    return shows[0]
+
+
+@pytest.fixture
+def staff_client(client):
+    client.force_login(f.CreateStaffUser(username="amon"))
+    return client
+
+
+def test_overview(staff_client, show, query_budget):
+    response = staff_client.get(reverse("economy_overview"))
+    query_budget(response, 23)
+
+
+def test_show_detail(staff_client, show, query_budget):
+    response = staff_client.get(reverse("economy_show_detail", args=[show.id]))
+    query_budget(response, 25)
+
+
+def test_show_guest_list(staff_client, show, query_budget):
+    response = staff_client.get(reverse("economy_show_guest_list", args=[show.id]))
+    query_budget(response, 14)
+
+
+def test_discounts(staff_client, show, query_budget):
+    response = staff_client.get(reverse("economy_discounts"))
+    query_budget(response, 23)
+
+
+def test_vouchers(staff_client, show, num_shows, query_budget):
+    f.CreateVoucher.create_batch(num_shows, created_by=f.CreateStaffUser(username="bmon"))
+    response = staff_client.get(reverse("economy_vouchers"))
+    query_budget(response, 23)
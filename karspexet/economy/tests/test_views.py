@@ -1,7 +1,11 @@
+import csv
+import io
+
 from django.test import TestCase
 from django.urls import reverse
 
 from factories import factories as f
+from karspexet.venue.models import Seat
 
 
 class TestOverview(TestCase):
@@ -35,6 +39,41 @@ class TestShowDetail(TestCase):
         self.assertContains(response, "Föreställningsöversikt")
 
 
+class TestShowGuestList(TestCase):
+    def test_streams_guests_as_csv(self):
+        venue = f.CreateVenue(num_seats=2)
+        seats = venue.seatinggroup_set.first().seat_set.order_by("id")
+        show = f.CreateShow(venue=venue)
+        f.CreateTicket(show=show, seat=seats[0], account__name="Bonnie Parker", reference="Åke")
+        f.CreateTicket(show=show, seat=seats[1], account__name="Clyde Barrow", ticket_type="student")
+
+        url = reverse("economy_show_guest_list", kwargs={"show_id": show.id})
+        assert self.client.get(url).status_code == 302
+
+        self.client.force_login(f.CreateStaffUser(username="dmon"))
+        response = self.client.get(url)
+
+        assert response.streaming
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode("utf-8-sig"))))
+        assert rows[0] == ["Sektion", "Plats", "Namn", "Telefonnummer", "E-postadress", "Biljettyp", "Referens"]
+        assert [row[2] for row in rows[1:]] == ["Bonnie Parker", "Clyde Barrow"]
+        assert rows[1][6] == "Åke"
+        assert rows[2][5] == "student"
+
+    def test_guest_list_cells_are_not_run_as_formulas(self):
+        show = f.CreateShow(venue=f.CreateVenue(num_seats=1))
+        f.CreateTicket(
+            show=show, seat=Seat.objects.get(), account__name="=HYPERLINK(\"http://evil\")", reference="@SUM(A1)"
+        )
+
+        self.client.force_login(f.CreateStaffUser(username="dmon"))
+        response = self.client.get(reverse("economy_show_guest_list", kwargs={"show_id": show.id}))
+
+        rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode("utf-8-sig"))))
+        assert rows[1][2] == "'=HYPERLINK(\"http://evil\")"
+        assert rows[1][6] == "'@SUM(A1)"
+
+
 class TestVouchers(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -5,6 +5,7 @@ from karspexet.economy import views
 urlpatterns = [
     path("", views.overview, name="economy_overview"),
     path("<int:show_id>/", views.show_detail, name="economy_show_detail"),
+    path("<int:show_id>/guests.csv", views.show_guest_list, name="economy_show_guest_list"),
     path("discounts/", views.discounts, name="economy_discounts"),
     path("vouchers/", views.vouchers, name="economy_vouchers"),
 ]
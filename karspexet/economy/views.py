@@ -1,7 +1,8 @@
-from collections import defaultdict
+import csv
 
 from django.contrib.admin.views.decorators import staff_member_required
-from django.shortcuts import redirect
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.template.response import TemplateResponse
 
 from karspexet.economy.forms import VoucherForm
@@ -11,7 +12,7 @@ from karspexet.ticket.models import Discount, Ticket, Voucher
 
 @staff_member_required
 def overview(request):
-    shows = Show.objects.order_by("-date").annotate_ticket_coverage()
+    shows = Show.objects.order_by("-date").annotate_sales_summary()
     return TemplateResponse(
         request,
         "economy/overview.html",
@@ -24,14 +25,10 @@ def overview(request):
 
 @staff_member_required
 def show_detail(request, show_id):
-    shows = Show.objects.filter(id=show_id).annotate_ticket_coverage()
-    show = shows[0]
+    show = get_object_or_404(Show.objects.annotate_ticket_coverage(), id=show_id)
 
-    tickets = show.ticket_set.select_related("seat", "account")
-    taken_seats = Ticket.objects.filter(show=show).values_list("seat_id", flat=True)
-    ticket_counts: dict[str, int] = defaultdict(int)
-    for t in tickets:
-        ticket_counts[t.ticket_type] += 1
+    tickets = list(show.ticket_set.select_related("seat__group", "account"))
+    taken_seats = [ticket.seat_id for ticket in tickets]
 
     return TemplateResponse(
         request,
@@ -40,12 +37,67 @@ def show_detail(request, show_id):
             "show": show,
             "taken_seats": taken_seats,
             "tickets": tickets,
-            "ticket_counts": ticket_counts,
             "user": request.user,
         },
     )
 
 
+GUEST_LIST_COLUMNS = {
+    "seat__group__name": "Sektion",
+    "seat__name": "Plats",
+    "account__name": "Namn",
+    "account__phone": "Telefonnummer",
+    "account__email": "E-postadress",
+    "ticket_type": "Biljettyp",
+    "reference": "Referens",
+}
+
+
+class _Echo:
+    """
+    Hands back whatever csv.writer writes to it, so each row can be streamed as soon as it is formatted
+    """
+
+    def write(self, value):
+        return value
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _spreadsheet_safe(value):
+    # Customers type their own names, emails and references, so keep spreadsheets from running them
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+@staff_member_required
+def show_guest_list(request, show_id):
+    """
+    The guests of a show as CSV, streamed straight from a server side cursor
+    """
+    show = get_object_or_404(Show, id=show_id)
+    rows = (
+        Ticket.objects.filter(show=show)
+        .order_by("seat__group__name", "seat_id")
+        .values_list(*GUEST_LIST_COLUMNS)
+        .iterator(chunk_size=2000)
+    )
+
+    def lines():
+        writer = csv.writer(_Echo())
+        # Excel needs the byte order mark to read the file as UTF-8
+        yield "\ufeff" + writer.writerow(GUEST_LIST_COLUMNS.values())
+        for row in rows:
+            yield writer.writerow([_spreadsheet_safe(value) for value in row])
+
+    response = StreamingHttpResponse(lines(), content_type="text/csv; charset=utf-8")
+    response["Content-Disposition"] = f'attachment; filename="gastlista-{show.date:%Y-%m-%d-%H%M}.csv"'
+    return response
+
+
 @staff_member_required
 def discounts(request):
     discounts = Discount.objects.select_related("reservation", "voucher").all()
@@ -61,7 +113,7 @@ def discounts(request):
 
 @staff_member_required
 def vouchers(request):
-    vouchers = Voucher.objects.active().order_by("-created_at")
+    vouchers = Voucher.objects.active().select_related("created_by").order_by("-created_at")
 
     form = VoucherForm(data=request.POST or None, created_by=request.user)
     if request.method == "POST" and form.is_valid():
@@ -0,0 +1,78 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetrics:
+    """
+    Counts the queries of a request and the time spent in the database, rendering templates and in total
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.total_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Installed as a database execute wrapper for the duration of the request
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def server_timing(self) -> str:
+        return ", ".join([
+            f"db;desc=\"{self.queries} queries\";dur={self.db_time * 1000:.1f}",
+            f"template;dur={self.template_time * 1000:.1f}",
+            f"total;dur={self.total_time * 1000:.1f}",
+        ])
+
+
+class RequestMetricsMiddleware:
+    """
+    Logs the metrics of every request, and optionally exposes them as a Server-Timing header.
+
+    Place it close to the top of MIDDLEWARE so the queries of the other middleware are counted too. The
+    rows of a streaming response are fetched after the response leaves the middleware, so they are not.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.metrics = RequestMetrics()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        metrics.total_time = time.perf_counter() - start
+
+        response.metrics = metrics
+        view = request.resolver_match.view_name if request.resolver_match else None
+        logger.info(
+            "view=%s status=%s queries=%d db_ms=%.1f template_ms=%.1f total_ms=%.1f",
+            view, response.status_code, metrics.queries,
+            metrics.db_time * 1000, metrics.template_time * 1000, metrics.total_time * 1000,
+        )
+        if settings.SERVER_TIMING:
+            response["Server-Timing"] = metrics.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponses are rendered right after the template response middleware has run
+        start = time.perf_counter()
+
+        def rendered(response):
+            request.metrics.template_time += time.perf_counter() - start
+
+        response.add_post_render_callback(rendered)
+        return response
@@ -99,6 +99,7 @@ INSTALLED_APPS = [
 ] + OUR_APPS
 
 MIDDLEWARE = [
+    "karspexet.middleware.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "csp.middleware.CSPMiddleware",
@@ -168,6 +169,12 @@ if to_bool(ENV.get("HTTPS", "False")):
 
 CSRF_TRUSTED_ORIGINS=ENV.get("CSRF_TRUSTED_ORIGINS", "").split(",")
 
+# Sessions
+# The booking pages only save the session when its values change. "signed_cookies" keeps the sessions
+# out of the database altogether, but lets customers read their contact details from the cookie and
+# keeps logged in staff logged in until the cookie expires. "cached_db" needs a cache shared by all workers.
+SESSION_ENGINE = ENV.get("SESSION_ENGINE", "django.contrib.sessions.backends.db")
+
 
 # Internationalization
 LANGUAGES = [
@@ -197,6 +204,12 @@ STATICFILES_FINDERS = [
 STATIC_ROOT = os.path.abspath("./staticfiles")
 MEDIA_ROOT = os.path.abspath("./uploads")
 
+# Files generated by the app which can be rebuilt at any time, like pre-rendered seat maps
+CACHE_DIR = os.path.abspath(ENV.get("CACHE_DIR", "./cache"))
+SEAT_MAP_CACHE_DIR = os.path.join(CACHE_DIR, "seat_maps")
+TICKET_PDF_CACHE_DIR = os.path.join(CACHE_DIR, "ticket_pdfs")
+QR_CODE_CACHE_DIR = os.path.join(CACHE_DIR, "qr_codes")
+
 STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "dist"),
     os.path.join(BASE_DIR, "static"),
@@ -293,6 +306,9 @@ CMS_PLACEHOLDER_CONF = {
 
 CSP_DEFAULT_SRC = tuple(ENV.get("CSP_DEFAULT_SRC", "'self'").split(","))
 
+# Expose the query count and timings of each request in a Server-Timing header
+SERVER_TIMING = to_bool(ENV.get("SERVER_TIMING", "False"))
+
 # Logging
 LOGGING = {
     "version": 1,
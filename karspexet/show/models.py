@@ -3,12 +3,14 @@ from __future__ import annotations
 from datetime import datetime
 
 from django.db import models
-from django.db.models import Count
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce, NullIf
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
-from karspexet.venue.models import Venue
+from karspexet.ticket.models import Discount, Ticket, TicketType
+from karspexet.venue.models import Seat
 
 
 class Production(models.Model):
@@ -25,25 +27,73 @@ class ShowQuerySet(models.QuerySet):
         today = timezone.make_aware(datetime.today())
         return self.filter(date__gte=today, visible=True)
 
-    def annotate_ticket_coverage(self) -> list[Show]:
+    def annotate_ticket_coverage(self) -> models.QuerySet:
         """
-        Aggregates the ticket and seat counts for each show in the query
+        Annotates each show with its ticket sales, computed by the database in a single query
+
+        Adds `ticket_count`, `<ticket type>_count` for each TicketType, `revenue` (the ticket prices),
+        `discount_total` (vouchers used on finalized reservations), `seat_count` and `sales_percentage`.
         """
-        shows = self.prefetch_related("production").annotate(ticket_count=Count("ticket"))
+        discount_total = (
+            Discount.objects.filter(reservation__show=OuterRef("pk"), reservation__finalized=True)
+            .order_by()
+            .values("reservation__show")
+            .annotate(total=Sum("amount"))
+            .values("total")
+        )
+        ticket_type_counts = {
+            f"{ticket_type}_count": _ticket_aggregate(Count("id", filter=Q(ticket_type=ticket_type)))
+            for ticket_type in TicketType
+        }
+
+        return (
+            self.select_related("production", "venue")
+            .annotate(
+                ticket_count=_ticket_aggregate(Count("id")),
+                revenue=_ticket_aggregate(Sum("price")),
+                discount_total=Coalesce(Subquery(discount_total), 0),
+                seat_count=_seat_count(),
+                **ticket_type_counts,
+            )
+            .annotate(sales_percentage=_sales_percentage())
+        )
 
-        venue_ids = {show.venue_id for show in shows}
-        venues: dict[int, Venue] = (
-            Venue.objects.filter(id__in=venue_ids)
-            .annotate(seat_count=Count("seatinggroup__seat"))
-            .in_bulk()
+    def annotate_sales_summary(self) -> models.QuerySet:
+        """
+        Annotates each show with the same sales figures as `annotate_ticket_coverage`, read from its
+        SalesSummary instead of being computed from the tickets
+        """
+        summary_fields = ["ticket_count", "revenue", "discount_total", *(f"{t}_count" for t in TicketType)]
+        return (
+            self.select_related("production", "venue")
+            .annotate(
+                seat_count=_seat_count(),
+                **{field: Coalesce(F(f"sales_summary__{field}"), 0) for field in summary_fields},
+            )
+            .annotate(sales_percentage=_sales_percentage())
         )
 
-        for show in shows:
-            venue = venues[show.venue_id]
-            show.venue = venue
-            show.sales_percentage = 100 * ((show.ticket_count / venue.seat_count) if venue.seat_count else 0)
 
-        return shows
+def _ticket_aggregate(aggregate):
+    # A subquery per show rather than a join on the tickets, since grouping the joined rows would
+    # make Postgres evaluate the other subqueries once for every ticket
+    tickets = Ticket.objects.filter(show=OuterRef("pk")).order_by().values("show").annotate(value=aggregate)
+    return Coalesce(Subquery(tickets.values("value")), 0)
+
+
+def _seat_count():
+    seat_count = (
+        Seat.objects.filter(group__venue=OuterRef("venue_id"))
+        .order_by()
+        .values("group__venue")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Coalesce(Subquery(seat_count), 0)
+
+
+def _sales_percentage():
+    return Coalesce(100.0 * F("ticket_count") / NullIf(F("seat_count"), 0), 0.0, output_field=models.FloatField())
 
 
 class Show(models.Model):
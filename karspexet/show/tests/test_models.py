@@ -1,8 +1,10 @@
+import pytest
 from django.test import TestCase
 from django.utils import timezone
 
+from factories import factories as f
 from karspexet.show.models import Production, Show
-from karspexet.venue.models import Venue
+from karspexet.venue.models import Seat, Venue
 
 
 class ShowTests(TestCase):
@@ -15,3 +17,33 @@ class ShowTests(TestCase):
 
         show = Show(date=timezone.now(), production=production, venue=venue)
         show.save()
+
+
+@pytest.mark.django_db
+class TestAnnotateTicketCoverage:
+    def test_aggregates_sales_in_one_query(self, django_assert_num_queries):
+        venue = f.CreateVenue(num_seats=4)
+        seats = list(Seat.objects.filter(group__venue=venue))
+        show = f.CreateShow(venue=venue)
+        empty_show = f.CreateShow(venue=f.CreateVenue())
+        f.CreateTicket(show=show, seat=seats[0], price=250, ticket_type="normal")
+        f.CreateTicket(show=show, seat=seats[1], price=200, ticket_type="student")
+        f.CreateTicket(show=show, seat=seats[2], price=200, ticket_type="student")
+        reservation = f.CreateReservation(show=show, tickets={str(seats[0].id): "normal"}, finalized=True)
+        f.CreateDiscount(reservation=reservation, amount=100)
+
+        with django_assert_num_queries(1):
+            shows = {s.id: s for s in Show.objects.annotate_ticket_coverage()}
+
+        assert shows[show.id].ticket_count == 3
+        assert shows[show.id].student_count == 2
+        assert shows[show.id].normal_count == 1
+        assert shows[show.id].sponsor_count == 0
+        assert shows[show.id].revenue == 650
+        assert shows[show.id].discount_total == 100
+        assert shows[show.id].seat_count == 4
+        assert shows[show.id].sales_percentage == 75
+
+        assert shows[empty_show.id].ticket_count == 0
+        assert shows[empty_show.id].seat_count == 0
+        assert shows[empty_show.id].sales_percentage == 0
@@ -1,15 +1,18 @@
 from django.contrib import admin
 from django.utils.html import format_html, format_html_join
 
+from karspexet.show.models import Show
 from karspexet.ticket.models import (
     Account,
     Discount,
+    OutgoingEmail,
     PricingModel,
     Reservation,
+    StripeEvent,
     Ticket,
     Voucher,
 )
-from karspexet.utils import admin_change_url
+from karspexet.utils import EstimatedCountPaginator, admin_change_url
 
 
 def admin_change_link(obj) -> str:
@@ -22,6 +25,16 @@ def show_link(self, obj=None):
     return admin_change_link(obj.show if obj else None)
 
 
+class ShowListFilter(admin.RelatedFieldListFilter):
+    def field_choices(self, field, request, model_admin):
+        # The name of a show includes the name of its production
+        shows = Show.objects.select_related("production")
+        ordering = self.field_admin_ordering(field, request, model_admin)
+        if ordering:
+            shows = shows.order_by(*ordering)
+        return [(show.pk, str(show)) for show in shows]
+
+
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
     fields = (
@@ -36,8 +49,10 @@ class ReservationAdmin(admin.ModelAdmin):
     search_fields = ("reservation_code",)
     list_select_related = ["show", "show__production"]
     list_display = ("reservation_code", "show", "finalized", "ticket_price", "total", "session_timeout", "tickets")
-    list_filter = ("finalized", "show")
+    list_filter = ("finalized", ("show", ShowListFilter))
     readonly_fields = ("show_link", "reservation_code", "related_tickets")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     show_link = show_link
 
@@ -50,7 +65,8 @@ class ReservationAdmin(admin.ModelAdmin):
     def related_tickets(self, obj=None):
         if obj is None:
             return ""
-        tickets = [(admin_change_url(t), f"{t.seat}: {t.account.name}") for t in obj.ticket_set().all()]
+        tickets = obj.ticket_set.select_related("seat", "account")
+        tickets = [(admin_change_url(t), f"{t.seat}: {t.account.name}") for t in tickets]
         return format_html_join("<br>", '<a href="{0}">{1}</a>', tickets)
 
 
@@ -66,8 +82,11 @@ class TicketAdmin(admin.ModelAdmin):
     )
     search_fields = ("reservation__reservation_code", "ticket_code")
     list_display = ("ticket_code", "show", "price", "ticket_type", "seat", "account")
+    list_select_related = ["show__production", "seat", "account"]
     raw_id_fields = ("account", "seat")
     readonly_fields = ("show_link", "reservation", "ticket_code")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     show_link = show_link
 
@@ -78,7 +97,7 @@ class TicketAdmin(admin.ModelAdmin):
         return True
 
     def reservation(self, obj=None):
-        return admin_change_link(obj.get_reservation() if obj else None)
+        return admin_change_link(obj.reservation if obj else None)
 
 
 class IsUsedFilter(admin.SimpleListFilter):
@@ -98,9 +117,9 @@ class IsUsedFilter(admin.SimpleListFilter):
 
 @admin.register(Voucher)
 class VoucherAdmin(admin.ModelAdmin):
-    list_display = ("code", "amount", "note", "is_used")
+    list_display = ("code", "amount", "note", "is_used", "used_by")
     list_filter = (IsUsedFilter, "expiry_date")
-    list_select_related = ("discount",)
+    list_select_related = ("discount__reservation",)
     fields = (
         ("is_used", "used_by"),
         ("note", "amount"),
@@ -126,9 +145,7 @@ class VoucherAdmin(admin.ModelAdmin):
             return False
 
     def used_by(self, obj):
-        if not obj:
-            return ""
-        if not obj.discount:
+        if not self.is_used(obj):
             return ""
         return admin_change_link(obj.discount.reservation)
 
@@ -150,3 +167,19 @@ class PricingModelAdmin(admin.ModelAdmin):
 @admin.register(Account)
 class AccountAdmin(admin.ModelAdmin):
     list_display = ("name", "email", "phone")
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ("recipient", "subject", "created_at", "sent_at", "attempts")
+    list_filter = [("sent_at", admin.EmptyFieldListFilter)]
+    search_fields = ["recipient"]
+    readonly_fields = ["recipient", "from_email", "subject", "body", "created_at", "sent_at", "attempts", "last_error"]
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ("event_id", "type", "received_at", "processed_at", "attempts")
+    list_filter = ["type", ("processed_at", admin.EmptyFieldListFilter)]
+    search_fields = ["event_id"]
+    readonly_fields = ["event_id", "type", "payload", "received_at", "processed_at", "attempts", "last_error"]
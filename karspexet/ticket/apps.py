@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class TicketConfig(AppConfig):
+    name = "karspexet.ticket"
+
+    def ready(self):
+        from karspexet.ticket import signals  # noqa: F401
@@ -1,15 +1,21 @@
 from __future__ import annotations
 
+import random
+
 from dateutil import parser
 from dateutil.relativedelta import relativedelta
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
 
-from karspexet.ticket.models import PricingModel, Reservation
+from karspexet.ticket.models import PricingModel, Reservation, ReservationSeat
 from karspexet.venue.models import Seat
 
 SESSION_TIMEOUT_MINUTES = 30
+# How far the session timeout may lag behind before a page view moves it, so that customers
+# clicking around the booking pages don't save their session on every request
+SESSION_TIMEOUT_SLACK_MINUTES = 1
+# How many times to pick new seats for a free seating order, when others claim the picked ones first
+SEAT_CLAIM_ATTEMPTS = 3
 
 
 def session_expired(request) -> bool:
@@ -22,31 +28,59 @@ def session_expired(request) -> bool:
 
 def set_session_timeout(request) -> None:
     timeout_at = timezone.now() + relativedelta(minutes=SESSION_TIMEOUT_MINUTES)
+    current = request.session.get("reservation_timeout")
+    if current and parser.parse(current) > timeout_at - relativedelta(minutes=SESSION_TIMEOUT_SLACK_MINUTES):
+        return
     request.session["reservation_timeout"] = timeout_at.isoformat()
 
 
-def get_or_create_reservation_object(request, show) -> Reservation:
+def forget_reservation(session, show_id: int):
+    """
+    Removes the reservation of the show from the session, and returns its id
+    """
+    reservation_id = session.pop(f"show_{show_id}", None)
+    session.pop("reservation_timeout", None)
+    session.pop("payment_intent_id", None)
+    return reservation_id
+
+
+def get_reservation_object(request, show) -> Reservation | None:
+    """
+    The reservation the customer has started for the show, without creating one
+
+    Expired reservations are left alone, since others may have taken over their seats by now.
+    """
+    reservation_id = request.session.get(f"show_{show.id}")
+    if not reservation_id:
+        return None
+    return Reservation.active.filter(pk=reservation_id, finalized=False).first()
+
+
+def extend_reservation_timeout(reservation) -> None:
     timeout = timezone.now() + relativedelta(minutes=SESSION_TIMEOUT_MINUTES)
-    session_key = f"show_{show.id}"
-    reservation_id = request.session.get(session_key)
-
-    if reservation_id:
-        try:
-            reservation = Reservation.objects.get(pk=reservation_id, finalized=False)
-            reservation.session_timeout = timeout
-            reservation.save()
-            return reservation
-        except ObjectDoesNotExist:
-            pass
+    if reservation.session_timeout > timeout - relativedelta(minutes=SESSION_TIMEOUT_SLACK_MINUTES):
+        return
+    reservation.session_timeout = timeout
+    # Only the timeout changes, so there's no need for save() to calculate the price again
+    Reservation.objects.filter(pk=reservation.pk).update(session_timeout=timeout, last_modified_at=timezone.now())
+
 
+def get_or_create_reservation_object(request, show) -> Reservation:
+    reservation = get_reservation_object(request, show)
+    if reservation:
+        extend_reservation_timeout(reservation)
+        return reservation
+
+    timeout = timezone.now() + relativedelta(minutes=SESSION_TIMEOUT_MINUTES)
     reservation = Reservation.objects.create(show=show, tickets={}, session_timeout=timeout)
-    request.session[session_key] = reservation.id
+    request.session[f"show_{show.id}"] = reservation.id
 
     return reservation
 
 
-def all_seats_available(qs, seat_ids) -> bool:
-    return not qs.filter(tickets__has_any_keys=seat_ids).exists()
+def all_seats_available(reservation, seat_ids) -> bool:
+    held_seats = ReservationSeat.objects.active().filter(show_id=reservation.show_id, seat_id__in=seat_ids)
+    return not held_seats.exclude(reservation=reservation).exists()
 
 
 def seat_specifications(request) -> dict:
@@ -57,6 +91,22 @@ def seat_specifications(request) -> dict:
     }
 
 
+def pick_free_seats(available_seats: list[Seat], requested_seats: dict[str, int]) -> dict[str, list[Seat]]:
+    """
+    Pick seats for each ticket type of a free seating order
+
+    The seats are picked in the order of their seating groups, but at random within a group, so
+    customers ordering at the same time rarely try to claim the same seats.
+    """
+    shuffled = sorted(available_seats, key=lambda seat: (seat.group_id, random.random()))
+    seats = {}
+    idx = 0
+    for ticket_type, num_seats in requested_seats.items():
+        seats[ticket_type] = shuffled[idx:idx + num_seats]
+        idx += num_seats
+    return seats
+
+
 def some_seat_is_missing_ticket_type(seat_params) -> bool:
     return any(not ticket_type for (seat, ticket_type) in seat_params.items())
 
@@ -84,12 +134,13 @@ def payment_partial(reservation) -> str:
 
 def get_used_seats(reservation: Reservation) -> list[tuple[str, str, int]]:
     seats: list[tuple[str, str, int]] = []
+    price_table = PricingModel.objects.price_table(reservation.show.venue_id)
     if reservation.show.free_seating:
         reserved_seats: dict = {}
         for seat in reservation.seats():
             ticket_type = reservation.tickets[str(seat.id)]
             tickets = reserved_seats.get(ticket_type, {
-                'price': seat.price_for_type(ticket_type),
+                'price': price_table.price_for(seat.group_id, ticket_type),
                 'count': 0,
                 'group': seat.group.name,
             })
@@ -109,6 +160,6 @@ def get_used_seats(reservation: Reservation) -> list[tuple[str, str, int]]:
             seats.append((
                 "%s: %s" % (seat.group.name, seat.name),
                 ticket_type,
-                seat.price_for_type(ticket_type),
+                price_table.price_for(seat.group_id, ticket_type),
             ))
     return seats
@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from karspexet.ticket.tasks import delete_expired_reservations
+
+
+class Command(BaseCommand):
+    help = "Delete reservations that were abandoned without being paid, in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--grace-hours", type=float, default=24,
+            help="Keep expired reservations this long, so late payments still find their reservation",
+        )
+        parser.add_argument("--interval", type=float, help="Keep running, looking for expired reservations this often (seconds)")
+
+    def handle(self, *args, **options):
+        while True:
+            self._delete_all(options["batch_size"], timedelta(hours=options["grace_hours"]))
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
+
+    def _delete_all(self, batch_size, grace_period):
+        expired_before = timezone.now() - grace_period
+        started = time.monotonic()
+        total = 0
+        while True:
+            deleted = delete_expired_reservations(expired_before, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                break
+
+        elapsed = time.monotonic() - started
+        self.stdout.write("Deleted %s expired reservations in %.1f s (%.0f/s)" % (total, elapsed, total / elapsed if elapsed else 0))
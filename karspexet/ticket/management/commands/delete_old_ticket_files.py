@@ -0,0 +1,28 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from karspexet.ticket.pdf import delete_old_ticket_pdfs
+from karspexet.ticket.utils import delete_old_qr_codes
+
+
+class Command(BaseCommand):
+    help = "Delete ticket PDFs and QR codes that were created long ago, they are created again if they are needed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age-days", type=float, default=30, help="Keep files created this recently")
+        parser.add_argument("--interval", type=float, help="Keep running, looking for old files this often (seconds)")
+
+    def handle(self, *args, **options):
+        while True:
+            created_before = timezone.now() - timedelta(days=options["max_age_days"])
+            pdfs = delete_old_ticket_pdfs(created_before)
+            qr_codes = delete_old_qr_codes(created_before)
+            self.stdout.write(
+                "Deleted %s ticket PDFs and %s QR codes created before %s" % (pdfs, qr_codes, created_before)
+            )
+            if options["interval"] is None:
+                return
+            time.sleep(options["interval"])
@@ -0,0 +1,44 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from karspexet.ticket.payment import process_stripe_events
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = "Process received Stripe webhook events, waiting for new ones when there are none left"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Number of events processed at the same time")
+        parser.add_argument("--interval", type=float, default=2, help="Seconds to wait when there is nothing to do")
+        parser.add_argument("--once", action="store_true", help="Process the pending events and exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            processed = process_stripe_events(batch_size=1000)
+            self.stdout.write("Processed %s Stripe events" % processed)
+            return
+
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            for _ in range(options["workers"]):
+                pool.submit(self._consume, options["interval"])
+
+    @staticmethod
+    def _consume(interval):
+        try:
+            while True:
+                try:
+                    processed = process_stripe_events()
+                except Exception:
+                    logger.exception("Failed to process Stripe events")
+                    processed = 0
+                if not processed:
+                    time.sleep(interval)
+        finally:
+            # Every thread gets its own database connection
+            connection.close()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from karspexet.ticket.models import SalesSummary
+
+
+class Command(BaseCommand):
+    help = "Recompute the sales summaries of all shows from their tickets"
+
+    def handle(self, *args, **options):
+        count = SalesSummary.objects.rebuild()
+        self.stdout.write("Rebuilt sales summaries for %s shows" % count)
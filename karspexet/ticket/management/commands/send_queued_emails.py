@@ -0,0 +1,34 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from karspexet.ticket.tasks import send_queued_emails
+
+logger = logging.getLogger(__file__)
+
+
+class Command(BaseCommand):
+    help = "Send queued emails in batches, waiting for new ones when the queue is empty"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to wait when there is nothing to send")
+        parser.add_argument("--once", action="store_true", help="Send a single batch and exit")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        while True:
+            try:
+                sent = send_queued_emails(batch_size)
+            except Exception:
+                # Typically the mail server being unreachable - keep the worker alive and try again
+                logger.exception("Failed to send queued emails")
+                sent = 0
+
+            if sent:
+                self.stdout.write("Sent %s emails" % sent)
+            if options["once"]:
+                return
+            if sent < batch_size:
+                time.sleep(options["interval"])
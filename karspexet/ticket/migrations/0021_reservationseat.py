@@ -0,0 +1,52 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def backfill_reservation_seats(apps, schema_editor):
+    Reservation = apps.get_model('ticket', 'Reservation')
+    ReservationSeat = apps.get_model('ticket', 'ReservationSeat')
+
+    # Finalized reservations go first, so they win if old data has seats held twice
+    reservations = (
+        Reservation.objects.filter(Q(session_timeout__gt=timezone.now()) | Q(finalized=True))
+        .order_by('-finalized', 'id')
+        .values_list('id', 'show_id', 'tickets')
+    )
+    holds = [
+        ReservationSeat(reservation_id=reservation_id, show_id=show_id, seat_id=int(seat_id), ticket_type=ticket_type)
+        for reservation_id, show_id, tickets in reservations.iterator()
+        for seat_id, ticket_type in (tickets or {}).items()
+    ]
+    ReservationSeat.objects.bulk_create(holds, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('show', '0001_initial'),
+        ('venue', '0001_initial'),
+        ('ticket', '0020_alter_ticket_ticket_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservationSeat',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_type', models.CharField(choices=[('normal', 'Fullpris'), ('student', 'Student'), ('sponsor', 'Sponsor')], default='normal', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reservation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ticket.reservation')),
+                ('seat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='venue.seat')),
+                ('show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='show.show')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reservationseat',
+            constraint=models.UniqueConstraint(fields=('show', 'seat'), name='unique_seat_hold_per_show'),
+        ),
+        migrations.RunPython(backfill_reservation_seats, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.15 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+# The ticket types when this migration was written
+TICKET_TYPES = ['normal', 'student', 'sponsor']
+
+
+def build_sales_summaries(apps, schema_editor):
+    Ticket = apps.get_model('ticket', 'Ticket')
+    Discount = apps.get_model('ticket', 'Discount')
+    SalesSummary = apps.get_model('ticket', 'SalesSummary')
+
+    ticket_type_counts = {
+        f'{ticket_type}_count': Count('id', filter=Q(ticket_type=ticket_type)) for ticket_type in TICKET_TYPES
+    }
+    sales = (
+        Ticket.objects.order_by()
+        .values('show_id')
+        .annotate(ticket_count=Count('id'), revenue=Sum('price'), last_sale_at=Max('created_at'), **ticket_type_counts)
+    )
+    discounts = dict(
+        Discount.objects.filter(reservation__finalized=True)
+        .order_by()
+        .values('reservation__show_id')
+        .annotate(total=Sum('amount'))
+        .values_list('reservation__show_id', 'total')
+    )
+
+    summaries = [SalesSummary(discount_total=discounts.pop(row['show_id'], 0), **row) for row in sales]
+    summaries += [SalesSummary(show_id=show_id, discount_total=total) for show_id, total in discounts.items()]
+    SalesSummary.objects.bulk_create(summaries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('show', '0001_initial'),
+        ('ticket', '0023_stripeevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesSummary',
+            fields=[
+                ('show', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sales_summary', serialize=False, to='show.show')),
+                ('ticket_count', models.PositiveIntegerField(default=0)),
+                ('normal_count', models.PositiveIntegerField(default=0)),
+                ('student_count', models.PositiveIntegerField(default=0)),
+                ('sponsor_count', models.PositiveIntegerField(default=0)),
+                ('revenue', models.PositiveIntegerField(default=0)),
+                ('discount_total', models.PositiveIntegerField(default=0)),
+                ('last_sale_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(build_sales_summaries, reverse_code=migrations.RunPython.noop),
+    ]
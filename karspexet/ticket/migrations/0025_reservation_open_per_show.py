@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 19:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('show', '0001_initial'),
+        ('ticket', '0024_salessummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('finalized', False)), fields=['show', 'session_timeout'], name='reservation_open_per_show'),
+        ),
+    ]
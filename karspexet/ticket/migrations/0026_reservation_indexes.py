@@ -0,0 +1,23 @@
+# Generated by Django 4.2.15 on 2026-10-18 20:15
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('show', '0001_initial'),
+        ('ticket', '0025_reservation_open_per_show'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('finalized', True)), fields=['show'], name='reservation_finalized_per_show'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tickets'], name='reservation_tickets_gin'),
+        ),
+    ]
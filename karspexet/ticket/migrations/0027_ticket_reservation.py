@@ -0,0 +1,31 @@
+# Generated by Django 4.2.15 on 2026-10-18 20:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ticket', '0026_reservation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ticket',
+            name='reservation',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='ticket.reservation'),
+        ),
+        # A ticket belongs to the finalized reservation of its show that holds its seat
+        migrations.RunSQL(
+            """
+            UPDATE ticket_ticket
+            SET reservation_id = ticket_reservation.id
+            FROM ticket_reservation
+            WHERE ticket_reservation.finalized
+              AND ticket_reservation.show_id = ticket_ticket.show_id
+              AND ticket_reservation.tickets ? ticket_ticket.seat_id::text
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,20 +1,23 @@
 from __future__ import annotations
 
 import enum
-from datetime import date
+from collections import Counter, defaultdict
+from datetime import date, datetime
 from string import ascii_uppercase, digits
 
 from django.conf import settings
 from django.contrib.postgres.fields import HStoreField
+from django.contrib.postgres.indexes import GinIndex
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Q
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef, Q, Sum
+from django.db.models.functions import Greatest
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.crypto import get_random_string
 
-from karspexet.venue.models import Seat
+from karspexet.venue.models import Seat, Venue
 
 
 class TicketType(str, enum.Enum):
@@ -55,7 +58,8 @@ def _next_fifteenth_september():
 
 class ActiveReservationsManager(models.Manager):
     def get_queryset(self):
-        return super().get_queryset().filter(Q(session_timeout__gt=timezone.now()) | Q(finalized=True))
+        # Spelled out so each branch matches one of the partial indexes on Reservation
+        return super().get_queryset().filter(Q(finalized=False, session_timeout__gt=timezone.now()) | Q(finalized=True))
 
 
 class Reservation(models.Model):
@@ -72,6 +76,13 @@ class Reservation(models.Model):
     objects = models.Manager()
     active = ActiveReservationsManager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["show", "session_timeout"], condition=Q(finalized=False), name="reservation_open_per_show"),
+            models.Index(fields=["show"], condition=Q(finalized=True), name="reservation_finalized_per_show"),
+            GinIndex(fields=["tickets"], name="reservation_tickets_gin"),
+        ]
+
     def __repr__(self):
         fields = ["id", "show_id"]
         return "<%s(%s)>" % (type(self).__name__, ", ".join(f"{f}={getattr(self, f)}" for f in fields))
@@ -98,10 +109,7 @@ class Reservation(models.Model):
         return list(self.tickets.keys())
 
     def seats(self):
-        return Seat.objects.filter(pk__in=self.seat_ids()).all()
-
-    def ticket_set(self):
-        return Ticket.objects.filter(show=self.show).filter(seat_id__in=self.seat_ids())
+        return Seat.objects.filter(pk__in=self.seat_ids()).select_related("group")
 
     def num_tickets(self) -> int:
         return len(self.seat_ids())
@@ -120,7 +128,14 @@ class Reservation(models.Model):
         return discount
 
     def calculate_ticket_price_and_total(self) -> None:
-        self.ticket_price = sum(int(seat.price_for_type(self.tickets[str(seat.id)])) for seat in self.seats())
+        seat_groups = list(self.seats().values_list("id", "group_id"))
+        if seat_groups:
+            price_table = PricingModel.objects.price_table(self.show.venue_id)
+            self.ticket_price = sum(
+                price_table.price_for(group_id, self.tickets[str(seat_id)]) for seat_id, group_id in seat_groups
+            )
+        else:
+            self.ticket_price = 0
         try:
             self.total = self.ticket_price - self.discount.amount
         except ObjectDoesNotExist:
@@ -137,6 +152,85 @@ class Reservation(models.Model):
 
         self.tickets = tickets
 
+    def hold_seats(self) -> None:
+        """
+        Store a hold for every seat in `tickets`, replacing the previous holds of this reservation
+
+        The seats are claimed under one advisory lock per show and seat, taken in seat order, so
+        customers claiming different seats of a show never wait for each other and overlapping
+        claims can't deadlock. Holds left behind by expired reservations are released under the
+        locks, before checking that nobody else holds the seats.
+        """
+        seat_ids = sorted(int(seat_id) for seat_id in self.seat_ids())
+        try:
+            with transaction.atomic():
+                # The seats held so far are locked too, since releasing them must not race with
+                # someone else releasing them as expired
+                previous_holds = ReservationSeat.objects.filter(reservation=self)
+                previous_seat_ids = previous_holds.values_list("seat_id", flat=True)
+                _lock_seats(self.show_id, sorted(set(seat_ids).union(previous_seat_ids)))
+                previous_holds.delete()
+                holds = ReservationSeat.objects.filter(show_id=self.show_id, seat_id__in=seat_ids)
+                holds.expired().delete()
+                if holds.exists():
+                    raise SeatAlreadyHeldException(
+                        "Some seat is already held: reservation_id=%d seat_ids=%s" % (self.id, seat_ids)
+                    )
+                ReservationSeat.objects.bulk_create(
+                    ReservationSeat(reservation=self, show_id=self.show_id, seat_id=seat_id, ticket_type=ticket_type)
+                    for seat_id, ticket_type in sorted(self.tickets.items(), key=lambda item: int(item[0]))
+                )
+        except IntegrityError as e:
+            # Only reachable if a hold was written without taking the locks
+            raise SeatAlreadyHeldException(
+                "Some seat is already held: reservation_id=%d seat_ids=%s" % (self.id, seat_ids)
+            ) from e
+
+
+def _lock_seats(show_id: int, seat_ids: list[int]) -> None:
+    """
+    Take the transaction level advisory lock of each seat of the show, in the given order
+    """
+    if not seat_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_advisory_xact_lock(%s, seat_id) FROM unnest(%s::integer[]) AS seat_id",
+            [show_id, seat_ids],
+        )
+
+
+class ReservationSeatQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(Q(reservation__session_timeout__gt=timezone.now()) | Q(reservation__finalized=True))
+
+    def expired(self):
+        return self.filter(reservation__session_timeout__lte=timezone.now(), reservation__finalized=False)
+
+
+class ReservationSeat(models.Model):
+    """
+    A seat held by a Reservation, mirroring one entry of `Reservation.tickets`.
+
+    There can only be one hold per seat and show, which lets the database reject a seat that
+    someone else is already holding instead of finding out when the payment comes in.
+    """
+    reservation = models.ForeignKey(Reservation, null=False, on_delete=models.CASCADE)
+    show = models.ForeignKey("show.Show", null=False, on_delete=models.CASCADE)
+    seat = models.ForeignKey("venue.Seat", null=False, on_delete=models.CASCADE)
+    ticket_type = models.CharField(max_length=10, choices=TICKET_TYPES, default="normal")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ReservationSeatQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["show", "seat"], name="unique_seat_hold_per_show"),
+        ]
+
+    def __repr__(self):
+        return "<ReservationSeat reservation=%s show=%s seat=%s>" % (self.reservation_id, self.show_id, self.seat_id)
+
 
 class Account(models.Model):
     name = models.CharField(max_length=255)
@@ -155,6 +249,7 @@ class Ticket(models.Model):
     show = models.ForeignKey("show.Show", null=False, on_delete=models.PROTECT)
     seat = models.ForeignKey("venue.Seat", null=False, on_delete=models.PROTECT)
     account = models.ForeignKey(Account, null=False, on_delete=models.PROTECT)
+    reservation = models.ForeignKey(Reservation, null=True, blank=True, on_delete=models.PROTECT)
     created_at = models.DateTimeField(auto_now_add=True)
     last_modified_at = models.DateTimeField(auto_now=True)
     ticket_code = models.CharField(unique=True, max_length=16, default=_generate_random_code)
@@ -173,13 +268,12 @@ class Ticket(models.Model):
             return f"{self.show}, {self.seat.group}, {self.seat}"
 
     def get_reservation(self) -> Reservation | None:
-        qs = Reservation.objects.filter(show=self.show, finalized=True)
-        return qs.filter(tickets__keys__overlap=[self.seat_id]).first()
+        return self.reservation
 
 
 class VoucherQuerySet(models.QuerySet):
     def active(self):
-        return self.exclude(id__in=Discount.objects.values_list("id", flat=True))
+        return self.exclude(Exists(Discount.objects.filter(voucher=OuterRef("pk"))))
 
 
 class Voucher(models.Model):
@@ -200,7 +294,7 @@ class Voucher(models.Model):
 
     @staticmethod
     def active():
-        return Voucher.objects.exclude(id__in=Discount.objects.values_list('id', flat=True))
+        return Voucher.objects.active()
 
     def __str__(self):
         return f"id={self.id} amount={self.amount} code={self.code}"
@@ -225,12 +319,193 @@ class Discount(models.Model):
         return self.voucher.amount - self.amount
 
 
+class SalesSummaryManager(models.Manager):
+    def record_sale(self, reservation: Reservation, tickets: list[Ticket]) -> None:
+        """
+        Add newly issued tickets to the summary of their show
+        """
+        ticket_type_counts = Counter(str(ticket.ticket_type) for ticket in tickets)
+        self.get_or_create(show_id=reservation.show_id)
+        self.filter(show_id=reservation.show_id).update(
+            ticket_count=F("ticket_count") + len(tickets),
+            revenue=F("revenue") + sum(ticket.price for ticket in tickets),
+            discount_total=F("discount_total") + (reservation.ticket_price - reservation.total),
+            last_sale_at=Greatest(F("last_sale_at"), timezone.now()),
+            **{f"{ticket_type}_count": F(f"{ticket_type}_count") + count for ticket_type, count in ticket_type_counts.items()},
+        )
+
+    def rebuild(self) -> int:
+        """
+        Recompute every summary from the tickets and discounts. Returns the number of shows summarized.
+
+        The summary table is locked before the tickets are aggregated. Payments that have already recorded their sale
+        commit before the aggregation starts, and later payments wait until the rebuilt summaries are committed, so no
+        sale is counted twice or lost.
+        """
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("LOCK TABLE %s IN EXCLUSIVE MODE" % connection.ops.quote_name(self.model._meta.db_table))
+            summaries = _summarize_sales()
+            self.all().delete()
+            self.bulk_create(summaries, batch_size=1000)
+        return len(summaries)
+
+
+def _summarize_sales() -> list[SalesSummary]:
+    ticket_type_counts = {
+        f"{ticket_type}_count": Count("id", filter=Q(ticket_type=ticket_type)) for ticket_type in TicketType
+    }
+    sales = (
+        Ticket.objects.order_by()
+        .values("show_id")
+        .annotate(ticket_count=Count("id"), revenue=Sum("price"), last_sale_at=Max("created_at"), **ticket_type_counts)
+    )
+    discounts = dict(
+        Discount.objects.filter(reservation__finalized=True)
+        .order_by()
+        .values("reservation__show_id")
+        .annotate(total=Sum("amount"))
+        .values_list("reservation__show_id", "total")
+    )
+
+    summaries = [SalesSummary(discount_total=discounts.pop(row["show_id"], 0), **row) for row in sales]
+    summaries += [SalesSummary(show_id=show_id, discount_total=total) for show_id, total in discounts.items()]
+    return summaries
+
+
+class SalesSummary(models.Model):
+    """
+    The ticket sales of a show, kept up to date as tickets are issued so reports don't need to scan the tickets
+
+    Tickets created or removed outside of the payment flow (e.g. in the admin) are not counted until the
+    summaries are rebuilt with the `rebuild_sales_summaries` management command.
+    """
+    show = models.OneToOneField("show.Show", primary_key=True, related_name="sales_summary", on_delete=models.CASCADE)
+    ticket_count = models.PositiveIntegerField(default=0)
+    normal_count = models.PositiveIntegerField(default=0)
+    student_count = models.PositiveIntegerField(default=0)
+    sponsor_count = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveIntegerField(default=0)
+    discount_total = models.PositiveIntegerField(default=0)
+    last_sale_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SalesSummaryManager()
+
+    def __repr__(self):
+        return "<SalesSummary show=%s tickets=%s revenue=%s>" % (self.show_id, self.ticket_count, self.revenue)
+
+
+class OutgoingEmailQuerySet(models.QuerySet):
+    def pending(self):
+        return self.filter(
+            sent_at__isnull=True,
+            attempts__lt=OutgoingEmail.MAX_ATTEMPTS,
+            send_after__lte=timezone.now(),
+        )
+
+
+class OutgoingEmail(models.Model):
+    """
+    An email waiting to be sent by the `send_queued_emails` management command.
+
+    Requests only write a row here, so a slow mail server never holds up a web worker.
+    """
+    MAX_ATTEMPTS = 8
+
+    recipient = models.EmailField()
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    send_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    sent_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = OutgoingEmailQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["send_after"], condition=Q(sent_at__isnull=True), name="outgoing_email_unsent"),
+        ]
+
+    def __repr__(self):
+        return "<OutgoingEmail id=%s recipient=%s attempts=%s>" % (self.id, self.recipient, self.attempts)
+
+
+class StripeEventQuerySet(models.QuerySet):
+    def record(self, event) -> bool:
+        """
+        Store the event unless it has been received before. Returns whether it was new.
+        """
+        _, created = self.get_or_create(
+            event_id=event["id"],
+            defaults={"type": event["type"], "payload": event},
+        )
+        return created
+
+    def pending(self):
+        return self.filter(
+            processed_at__isnull=True,
+            attempts__lt=StripeEvent.MAX_ATTEMPTS,
+            process_after__lte=timezone.now(),
+        )
+
+
+class StripeEvent(models.Model):
+    """
+    A webhook event received from Stripe, processed by the `process_stripe_events` management command.
+
+    Events are stored by their Stripe id, so when Stripe delivers the same event again it is acknowledged
+    without being processed twice.
+    """
+    MAX_ATTEMPTS = 5
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=255)
+    payload = models.JSONField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    process_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    objects = StripeEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["process_after"], condition=Q(processed_at__isnull=True), name="stripe_event_unprocessed"),
+        ]
+
+    def __repr__(self):
+        return "<StripeEvent event_id=%s type=%s attempts=%s>" % (self.event_id, self.type, self.attempts)
+
+
 class ActivePricingModelManager(models.Manager):
     def active(self, timestamp=None):
         if not timestamp:
             timestamp = timezone.now()
         return super().get_queryset().filter(valid_from__lte=timestamp).order_by("-valid_from")
 
+    def price_table(self, venue_id) -> PriceTable:
+        """
+        All pricing models of the venue, loaded once per layout version of the venue
+
+        The table is kept in process memory. Saving or deleting a PricingModel bumps the layout
+        version of its venue (see `signals.py`), so every process loads a fresh table on next use.
+        """
+        version = Venue.objects.values_list("layout_version", flat=True).get(pk=venue_id)
+        table = _price_tables.get(venue_id)
+        if table is None or table.version != version:
+            pricing_models = (
+                self.filter(seating_group__venue_id=venue_id)
+                .order_by("-valid_from", "-id")
+                .values_list("seating_group_id", "valid_from", "prices")
+            )
+            table = PriceTable(version, pricing_models)
+            _price_tables[venue_id] = table
+        return table
+
 
 class PricingModel(models.Model):
     """
@@ -267,6 +542,39 @@ class PricingModel(models.Model):
         super().save(**kwargs)
 
 
+class PriceTable:
+    """
+    Resolves prices in memory, picking the pricing model with the latest `valid_from` that has
+    passed at the given time - the same one `ActivePricingModelManager.active` would.
+    """
+
+    def __init__(self, version: int, pricing_models) -> None:
+        self.version = version
+        self._prices: dict[int, list[tuple[datetime, dict]]] = defaultdict(list)
+        for seating_group_id, valid_from, prices in pricing_models:
+            self._prices[seating_group_id].append((valid_from, prices))
+
+    def prices_for(self, seating_group_id, timestamp=None) -> dict | None:
+        if not timestamp:
+            timestamp = timezone.now()
+        for valid_from, prices in self._prices.get(seating_group_id, []):
+            if valid_from <= timestamp:
+                return prices
+        return None
+
+    def price_for(self, seating_group_id, ticket_type, timestamp=None) -> int:
+        return int(self.prices_for(seating_group_id, timestamp)[ticket_type])
+
+
+_price_tables: dict[int, PriceTable] = {}
+
+
+def forget_price_tables() -> None:
+    # A rolled back transaction can hand out the same layout version twice, so the process that
+    # changed a pricing model must not trust its tables even if the version matches
+    _price_tables.clear()
+
+
 class InvalidVoucherException(Exception):
     pass
 
@@ -277,3 +585,16 @@ class AlreadyDiscountedException(Exception):
 
 class MultipleTicketTypeException(Exception):
     pass
+
+
+class SeatAlreadyHeldException(Exception):
+    pass
+
+
+class SeatsOccupiedException(Exception):
+    def __init__(self, reservation_id, seat_ids):
+        self.reservation_id = reservation_id
+        self.seat_ids = seat_ids
+        super().__init__(
+            f"Payment succeeded for Reservation={reservation_id}, but seats={seat_ids} are occupied",
+        )
@@ -1,15 +1,30 @@
 from __future__ import annotations
 
 import logging
+from datetime import timedelta
 
 import stripe
-
-from karspexet.ticket.models import Account, Reservation, Ticket
+from django.db import transaction
+from django.utils import timezone
+
+from karspexet.ticket.helpers import forget_reservation
+from karspexet.ticket.models import (
+    Account,
+    PricingModel,
+    Reservation,
+    SalesSummary,
+    SeatsOccupiedException,
+    StripeEvent,
+    Ticket,
+)
+from karspexet.ticket.pdf import pregenerate_ticket_pdfs
 from karspexet.ticket.tasks import send_ticket_email_to_customer
 from karspexet.venue.models import Seat
 
 logger = logging.getLogger(__name__)
 
+RETRY_BACKOFF = timedelta(minutes=1)
+
 
 def get_payment_intent_from_reservation(request, reservation) -> dict:
     payment_intent_id = request.session.get("payment_intent_id")
@@ -80,6 +95,42 @@ def handle_stripe_webhook(event: stripe.Event):
         logger.info("PaymentIntent=%s for Reservation=%s succeeded", payment_intent.id, reservation.id)
 
 
+def process_stripe_events(batch_size=20) -> int:
+    """
+    Process received Stripe events, oldest first, one transaction per event
+
+    Events are claimed with SKIP LOCKED so several consumers can run at once. An event that fails
+    is retried with exponential backoff, until it has been tried `StripeEvent.MAX_ATTEMPTS` times.
+
+    Returns the number of events that were processed.
+    """
+    processed = 0
+    for _ in range(batch_size):
+        with transaction.atomic():
+            stripe_event = (
+                StripeEvent.objects.pending()
+                .order_by("received_at", "id")
+                .select_for_update(skip_locked=True)
+                .first()
+            )
+            if stripe_event is None:
+                break
+
+            stripe_event.attempts += 1
+            try:
+                with transaction.atomic():
+                    handle_stripe_webhook(stripe.Event.construct_from(stripe_event.payload, stripe.api_key))
+            except Exception as e:
+                logger.exception("Failed to process Stripe Event=%s", stripe_event.event_id)
+                stripe_event.last_error = repr(e)
+                stripe_event.process_after = timezone.now() + RETRY_BACKOFF * 2 ** (stripe_event.attempts - 1)
+            else:
+                stripe_event.processed_at = timezone.now()
+                processed += 1
+            stripe_event.save(update_fields=["attempts", "last_error", "process_after", "processed_at"])
+    return processed
+
+
 def get_reference_from_payment(payment_method_id):
     try:
         return stripe.PaymentMethod.retrieve(payment_method_id).metadata.get("reference", "")
@@ -89,39 +140,72 @@ def get_reference_from_payment(payment_method_id):
         return None
 
 
-def handle_successful_payment(reservation: Reservation, billing_data: dict, reference=""):
+def handle_successful_payment(reservation: Reservation, billing_data: dict, reference="", session=None):
     """
     Our honored customer has paid us money - let's send them a ticket
+
+    Pass the session of the customer, when there is one, so that it no longer points at the paid reservation.
     """
-    if reservation.finalized:
-        return
-
-    billing = _pick(billing_data, ["name", "phone", "email"])
-    account = Account.objects.filter(**billing).first()
-    if account is None:
-        account = Account.objects.create(**billing)
-
-    for seat_id, ticket_type in reservation.tickets.items():
-        seat = Seat.objects.get(pk=seat_id)
-        # TODO: Prevent / handle uniqueness error better
-        if Ticket.objects.filter(show=reservation.show, seat=seat).exists():
-            raise Exception(
-                f"Payment succeeded for Reservation={reservation.id}, but seat={seat.id} is occupied",
-            )
+    if session is not None:
+        forget_reservation(session, reservation.show_id)
+
+    with transaction.atomic():
+        # Lock the reservation so that concurrent deliveries of the same payment issue tickets only once
+        locked = Reservation.objects.select_for_update().filter(pk=reservation.pk)
+        finalized = locked.values_list("finalized", flat=True).get()
+        if finalized:
+            reservation.finalized = True
+            return
 
-        ticket = Ticket.objects.create(
-            price=seat.price_for_type(ticket_type),
-            ticket_type=ticket_type,
-            show=reservation.show,
-            seat=seat,
-            account=account,
-            reference=reference
-        )
+        billing = _pick(billing_data, ["name", "phone", "email"])
+        account = Account.objects.filter(**billing).first()
+        if account is None:
+            account = Account.objects.create(**billing)
 
-    reservation.finalized = True
-    reservation.save()
+        tickets = issue_tickets(reservation, account, reference)
+        SalesSummary.objects.record_sale(reservation, tickets)
+
+        # The price was settled when the reservation was made, so skip the recalculation in Reservation.save
+        reservation.finalized = True
+        reservation.last_modified_at = timezone.now()
+        locked.update(finalized=True, last_modified_at=reservation.last_modified_at)
+
+        # Queued in the same transaction, so no paid reservation is left without its confirmation email
+        send_ticket_email_to_customer(reservation, account.email, account.name)
+        # For card payments this runs in the process_stripe_events worker, so the PDFs are rendered
+        # before anyone asks for them
+        transaction.on_commit(lambda: pregenerate_ticket_pdfs(reservation))
+
+
+def issue_tickets(reservation: Reservation, account: Account, reference="") -> list[Ticket]:
+    """
+    Create the tickets for all seats in the reservation, using the same number of queries regardless of its size
 
-    send_ticket_email_to_customer(reservation, account.email, account.name)
+    Raises SeatsOccupiedException listing every seat that already has a ticket for the show.
+    """
+    seat_ids = sorted(int(seat_id) for seat_id in reservation.tickets)
+    occupied = sorted(
+        Ticket.objects.filter(show_id=reservation.show_id, seat_id__in=seat_ids).values_list("seat_id", flat=True)
+    )
+    if occupied:
+        raise SeatsOccupiedException(reservation.id, occupied)
+
+    seat_groups = dict(Seat.objects.filter(pk__in=seat_ids).values_list("id", "group_id"))
+    price_table = PricingModel.objects.price_table(reservation.show.venue_id)
+
+    tickets = []
+    for seat_id in seat_ids:
+        ticket_type = reservation.tickets[str(seat_id)]
+        tickets.append(Ticket(
+            price=price_table.price_for(seat_groups[seat_id], ticket_type),
+            ticket_type=ticket_type,
+            show_id=reservation.show_id,
+            seat_id=seat_id,
+            account=account,
+            reservation=reservation,
+            reference=reference,
+        ))
+    return Ticket.objects.bulk_create(tickets)
 
 
 def _pick(data: dict, fields: list[str]) -> dict[str, str]:
@@ -0,0 +1,131 @@
+"""
+PDF tickets, rendered once and kept on disk
+
+A PDF is stored under a hash of the template and of everything it prints on the ticket, so it is only
+rendered again when something printed on the ticket changes. The hash is computed without rendering
+anything, and doubles as the ETag of the download.
+
+The PDFs are rendered by both the web server and the Stripe event worker, so TICKET_PDF_CACHE_DIR
+must be shared between them. Old PDFs are removed by the `delete_old_ticket_files` management command.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from functools import lru_cache
+from typing import BinaryIO
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.template.loader import get_template, render_to_string
+from django.urls import reverse
+
+from karspexet.ticket.utils import delete_old_files, qr_code_as_png_data_url
+
+logger = logging.getLogger(__name__)
+
+
+def ticket_pdf_path(reservation, ticket) -> str:
+    """
+    The path to the PDF of the ticket, rendering it first if it is not on disk already
+    """
+    path = os.path.join(settings.TICKET_PDF_CACHE_DIR, f"{_pdf_key(reservation, ticket)}.pdf")
+    if not os.path.exists(path):
+        _write_pdf(_render_html(reservation, ticket), path)
+    return path
+
+
+def open_ticket_pdf(reservation, ticket) -> tuple[BinaryIO, str]:
+    """
+    The open PDF file of the ticket and its hash, rendering it first if it is not on disk already
+    """
+    try:
+        path = ticket_pdf_path(reservation, ticket)
+        pdf = open(path, "rb")
+    except FileNotFoundError:
+        # Deleted by delete_old_ticket_files right after we checked, so render it again. Once the file
+        # is open it can be read to the end even if it is deleted.
+        path = ticket_pdf_path(reservation, ticket)
+        pdf = open(path, "rb")
+    return pdf, os.path.splitext(os.path.basename(path))[0]
+
+
+def pregenerate_ticket_pdfs(reservation) -> None:
+    """
+    Render the PDFs of all tickets in the reservation, so they are ready when the customer wants them
+    """
+    for ticket in reservation.ticket_set.select_related("seat__group"):
+        try:
+            ticket_pdf_path(reservation, ticket)
+        except Exception:
+            # Nothing is lost, the PDF will be rendered when it is downloaded instead
+            logger.exception("Failed to render PDF for Ticket=%s", ticket.id)
+
+
+def delete_old_ticket_pdfs(rendered_before: datetime) -> int:
+    """
+    Delete the PDFs rendered before the given time, and the leftovers of renderings that crashed. Returns
+    the number of files deleted.
+
+    A ticket that changes gets a PDF with a new name, so the old one is never downloaded again. A PDF that
+    is still in use is simply rendered again the next time it is downloaded.
+    """
+    return delete_old_files(settings.TICKET_PDF_CACHE_DIR, (".pdf", ".tmp"), rendered_before)
+
+
+def _pdf_key(reservation, ticket) -> str:
+    show = reservation.show
+    printed = [
+        _template_digest(),
+        settings.TIME_ZONE,
+        _ticket_url(reservation, ticket),
+        show.production.name,
+        show.production.alt_name,
+        show.date.isoformat(),
+        show.free_seating,
+        show.venue.name,
+        show.venue.address,
+        ticket.seat.group.name,
+        ticket.seat.name,
+    ]
+    return hashlib.sha256(json.dumps(printed).encode()).hexdigest()
+
+
+@lru_cache(maxsize=None)
+def _template_digest() -> str:
+    # A deploy that changes the template starts new processes, so this is computed once per process
+    return hashlib.sha256(get_template("ticket_detail.html").template.source.encode()).hexdigest()
+
+
+def _ticket_url(reservation, ticket) -> str:
+    site = Site.objects.get_current()
+    return f"https://{site.domain}{reverse('ticket_pdf', args=[reservation.id, ticket.ticket_code])}"
+
+
+def _render_html(reservation, ticket) -> str:
+    return render_to_string("ticket_detail.html", {
+        "reservation": reservation,
+        "show": reservation.show,
+        "venue": reservation.show.venue,
+        "production": reservation.show.production,
+        "ticket": ticket,
+        "seat": ticket.seat,
+        "qr_code": qr_code_as_png_data_url(_ticket_url(reservation, ticket)),
+    })
+
+
+def _write_pdf(html: str, path: str) -> None:
+    from xhtml2pdf import pisa
+
+    os.makedirs(settings.TICKET_PDF_CACHE_DIR, exist_ok=True)
+    # Write to a temporary file first, so nobody can download a half written PDF
+    with tempfile.NamedTemporaryFile(dir=settings.TICKET_PDF_CACHE_DIR, suffix=".tmp", delete=False) as f:
+        pisa_status = pisa.CreatePDF(html, dest=f)
+    if pisa_status.err:
+        os.remove(f.name)
+        raise Exception(pisa_status)
+    os.replace(f.name, path)
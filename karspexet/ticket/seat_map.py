@@ -0,0 +1,88 @@
+"""
+Cached seat map data for the select seats page
+
+The seats and prices of a venue only change when staff edit them, so everything that only
+depends on the venue is built once per `Venue.layout_version` and kept in the cache. Saving
+a Venue, SeatingGroup, Seat or PricingModel bumps the version (see `signals.py`).
+
+Which seats are taken is the only part computed per request, and it is applied on top of the
+cached seat map in the browser.
+"""
+from __future__ import annotations
+
+import json
+import os
+from contextlib import suppress
+from glob import glob
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import SafeString, mark_safe
+
+from karspexet.ticket.helpers import build_pricings_and_seats
+from karspexet.venue.models import Seat
+
+CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def seat_selection(venue, free_seating: bool) -> tuple[dict, str]:
+    """
+    The pricings of the venue, and the JSON config for the seat selection javascript
+    """
+    key = f"seat_map:selection:{venue.id}:{venue.layout_version}:{int(free_seating)}"
+    payload = cache.get(key)
+    if payload is None:
+        pricings, seats = build_pricings_and_seats(venue)
+        if free_seating:
+            pricings = next(iter(pricings.values()), {})
+
+        payload = (pricings, json.dumps({
+            "allSeats": seats,
+            "pricings": pricings,
+            "freeSeating": free_seating,
+        }))
+        cache.set(key, payload, CACHE_TIMEOUT)
+    return payload
+
+
+def seat_map_svg(venue) -> SafeString:
+    """
+    The SVG seat map of the venue, without any seats marked as taken
+
+    It is cached both in memory and on disk, where it is shared by all workers and survives restarts.
+    """
+    key = f"seat_map:svg:{venue.id}:{venue.layout_version}"
+    svg = cache.get(key)
+    if svg is None:
+        path = _svg_path(venue)
+        try:
+            with open(path) as f:
+                svg = f.read()
+        except FileNotFoundError:
+            svg = _render_svg(venue)
+            _write_svg(venue, path, svg)
+        cache.set(key, svg, CACHE_TIMEOUT)
+    return mark_safe(svg)
+
+
+def _render_svg(venue) -> str:
+    seats = Seat.objects.filter(group__venue=venue).order_by("group_id", "id").values("id", "x_pos", "y_pos")
+    return render_to_string("seat_map.svg", {"venue": venue, "seats": seats})
+
+
+def _svg_path(venue) -> str:
+    return os.path.join(settings.SEAT_MAP_CACHE_DIR, f"venue-{venue.id}-{venue.layout_version}.svg")
+
+
+def _write_svg(venue, path: str, svg: str) -> None:
+    os.makedirs(settings.SEAT_MAP_CACHE_DIR, exist_ok=True)
+    for outdated in glob(os.path.join(settings.SEAT_MAP_CACHE_DIR, f"venue-{venue.id}-*.svg")):
+        with suppress(FileNotFoundError):
+            os.remove(outdated)
+
+    # Write to a temporary file first, so no other worker can read a half written seat map
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(svg)
+    os.replace(tmp_path, path)
@@ -0,0 +1,31 @@
+from django.db.models import Subquery
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from karspexet.ticket.models import PricingModel, forget_price_tables
+from karspexet.venue.models import Seat, SeatingGroup, Venue, bump_layout_version
+
+
+def _venue_of_group(group_id):
+    return Subquery(SeatingGroup.objects.filter(id=group_id).values("venue_id"))
+
+
+@receiver(post_save, sender=Venue)
+def venue_changed(sender, instance, **kwargs):
+    bump_layout_version(instance.id)
+
+
+@receiver([post_save, post_delete], sender=SeatingGroup)
+def seating_group_changed(sender, instance, **kwargs):
+    bump_layout_version(instance.venue_id)
+
+
+@receiver([post_save, post_delete], sender=Seat)
+def seat_changed(sender, instance, **kwargs):
+    bump_layout_version(_venue_of_group(instance.group_id))
+
+
+@receiver([post_save, post_delete], sender=PricingModel)
+def pricing_model_changed(sender, instance, **kwargs):
+    bump_layout_version(_venue_of_group(instance.seating_group_id))
+    forget_price_tables()
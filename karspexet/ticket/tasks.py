@@ -1,23 +1,36 @@
 import logging
+from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
 from django.template.loader import render_to_string
+from django.utils import timezone
+
+from karspexet.ticket.models import OutgoingEmail, Reservation
 
 logger = logging.getLogger(__file__)
 
+RETRY_BACKOFF = timedelta(minutes=1)
+MAX_RETRY_BACKOFF = timedelta(hours=1)
+# How long a worker may take to send a batch before other workers pick up its unsent emails
+EMAIL_LEASE = timedelta(minutes=10)
+
 
 def send_ticket_email_to_customer(reservation, email, name=None):
-    """Send an email to the customer with a link to their tickets
+    """Queue an email to the customer with a link to their tickets
 
     If the supplied email is empty, this will silently fail. The reason for this is that this is used in the payment
-    flow, and if we raise an error here, it will crash the payment transaction, and at that point we have likely
-    charged someone's card without giving them tickets.
+    flow, where the email is queued in the same transaction as the tickets. Raising an error here rolls back the
+    whole payment, and at that point we have likely charged someone's card.
 
     Therefore the trade-off is made that if the customer fails to provide a valid email address, they will not receive
     an email. They will however, have another chance to send the reservation information via email at the
     reservation-detail page.
+
+    The email itself is sent later by the `send_queued_emails` management command.
     """
     if not email:
         return
@@ -33,14 +46,89 @@ def send_ticket_email_to_customer(reservation, email, name=None):
         "url": reservation_url,
     })
 
-    try:
-        send_mail(
-            subject,
-            body,
-            settings.TICKET_EMAIL_FROM_ADDRESS,
-            [email],
-            fail_silently=False,
+    OutgoingEmail.objects.create(
+        recipient=email,
+        from_email=settings.TICKET_EMAIL_FROM_ADDRESS,
+        subject=subject,
+        body=body,
+    )
+    logger.info("Queued confirmation email to %s", email)
+
+
+def send_queued_emails(batch_size=100) -> int:
+    """Send a batch of queued emails over a single connection to the mail server
+
+    Emails that fail are retried with exponential backoff, until they have been tried `OutgoingEmail.MAX_ATTEMPTS`
+    times. The batch is claimed with SKIP LOCKED in a short transaction that leases it to this worker for
+    `EMAIL_LEASE`, so several workers can share the queue, and the emails are sent after the transaction is over.
+
+    Returns the number of emails that were sent.
+    """
+    with transaction.atomic():
+        emails = list(
+            OutgoingEmail.objects.pending()
+            .order_by("send_after", "id")
+            .select_for_update(skip_locked=True)[:batch_size]
         )
-        logger.info("Send confirmation email to %s", email)
+        if not emails:
+            return 0
+        # An attempt is counted up front, so an email that crashes the worker is not retried forever
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            attempts=F("attempts") + 1, send_after=timezone.now() + EMAIL_LEASE
+        )
+
+    connection = get_connection()
+    try:
+        connection.open()
     except Exception as e:
-        logger.exception("Failed to send Email to %s", email)
+        logger.exception("Failed to connect to the mail server")
+        for email in emails:
+            _email_failed(email, e)
+        return 0
+
+    sent = 0
+    try:
+        for email in emails:
+            message = EmailMessage(
+                email.subject,
+                email.body,
+                email.from_email,
+                [email.recipient],
+                connection=connection,
+            )
+            try:
+                message.send()
+            except Exception as e:
+                logger.exception("Failed to send Email to %s", email.recipient)
+                _email_failed(email, e)
+            else:
+                logger.info("Sent confirmation email to %s", email.recipient)
+                OutgoingEmail.objects.filter(pk=email.pk).update(sent_at=timezone.now())
+                sent += 1
+    finally:
+        connection.close()
+    return sent
+
+
+def _email_failed(email, error) -> None:
+    attempts = email.attempts + 1
+    send_after = timezone.now() + min(RETRY_BACKOFF * 2 ** (attempts - 1), MAX_RETRY_BACKOFF)
+    OutgoingEmail.objects.filter(pk=email.pk).update(last_error=repr(error), send_after=send_after)
+
+
+def delete_expired_reservations(expired_before, batch_size=500) -> int:
+    """Delete one batch of reservations that were abandoned before `expired_before`
+
+    Reservations locked by someone else, e.g. a payment that is being processed, are skipped.
+
+    Returns the number of reservations that were deleted.
+    """
+    with transaction.atomic():
+        expired_ids = list(
+            Reservation.objects.filter(finalized=False, session_timeout__lt=expired_before)
+            .select_for_update(skip_locked=True)
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if expired_ids:
+            Reservation.objects.filter(id__in=expired_ids).delete()
+    return len(expired_ids)
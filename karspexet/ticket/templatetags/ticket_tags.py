@@ -1,8 +1,15 @@
 from django import template
 
+from karspexet.ticket.seat_map import seat_map_svg
+
 register = template.Library()
 
 
 @register.filter
 def subtract(value, arg):
     return int(value) - int(arg)
+
+
+@register.simple_tag
+def seat_map(venue):
+    return seat_map_svg(venue)
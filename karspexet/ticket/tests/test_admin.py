@@ -1,9 +1,15 @@
+from unittest import mock
+
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.db import connection
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from factories import factories as f
+from karspexet.ticket.models import Ticket
+from karspexet.utils import EstimatedCountPaginator
 
 # Remove CMS middleware, since they cause inconsistent query counts
 NON_CMS_MIDDLEWARE = [m for m in settings.MIDDLEWARE if not m.startswith("cms.")]
@@ -42,7 +48,7 @@ class TestAdminsAreFast(TestCase):
     def test_reservation_admin(self):
         objs = f.CreateReservationWithTicket.create_batch(self.num_objects)
 
-        with self.assertNumQueries(9):
+        with self.assertNumQueries(6):
             response = self.client.get(admin_changelist_url(objs[0]))
         self.assertEqual(response.status_code, 200)
 
@@ -55,11 +61,67 @@ class TestAdminsAreFast(TestCase):
 
     def test_voucher_admin(self):
         objs = f.CreateVoucher.create_batch(self.num_objects, created_by=self.user)
+        for voucher in objs[1:]:
+            f.CreateDiscount(voucher=voucher, reservation=f.CreateReservation(tickets={}))
 
         with self.assertNumQueries(5):
             response = self.client.get(admin_changelist_url(objs[0]))
         self.assertEqual(response.status_code, 200)
 
+    def test_venue_admin(self):
+        objs = f.CreateVenue.create_batch(self.num_objects, num_seats=2)
+
+        with self.assertNumQueries(5):
+            response = self.client.get(admin_changelist_url(objs[0]))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<td class="field-num_seats">2</td>', count=self.num_objects)
+
+    def test_seatinggroup_admin(self):
+        objs = f.CreateSeatingGroup.create_batch(self.num_objects)
+
+        with self.assertNumQueries(5):
+            response = self.client.get(admin_changelist_url(objs[0]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_seat_admin(self):
+        objs = f.CreateSeat.create_batch(self.num_objects)
+
+        with self.assertNumQueries(6):
+            response = self.client.get(admin_changelist_url(objs[0]))
+        self.assertEqual(response.status_code, 200)
+
+
+class TestAdminsAreFastWithMoreObjects(TestAdminsAreFast):
+    """
+    The same number of queries for a full page of objects
+    """
+
+    num_objects = 25
+
+
+class TestEstimatedCountPaginator(TestCase):
+    def test_unfiltered_count_is_estimated(self):
+        f.CreateTicket.create_batch(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE ticket_ticket")
+
+        with mock.patch.object(EstimatedCountPaginator, "threshold", 1):
+            with CaptureQueriesContext(connection) as queries:
+                count = EstimatedCountPaginator(Ticket.objects.order_by("id"), 100).count
+
+        self.assertEqual(count, 3)
+        self.assertNotIn("COUNT(", queries[0]["sql"])
+
+    def test_small_and_filtered_tables_are_counted(self):
+        tickets = f.CreateTicket.create_batch(3)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE ticket_ticket")
+
+        self.assertEqual(EstimatedCountPaginator(Ticket.objects.order_by("id"), 100).count, 3)
+        with mock.patch.object(EstimatedCountPaginator, "threshold", 1):
+            filtered = Ticket.objects.filter(show=tickets[0].show).order_by("id")
+            self.assertEqual(EstimatedCountPaginator(filtered, 100).count, 1)
+
 
 def admin_changelist_url(model):
-    return reverse("admin:ticket_%s_changelist" % type(model).__name__.lower())
+    return reverse("admin:%s_%s_changelist" % (model._meta.app_label, model._meta.model_name))
@@ -0,0 +1,38 @@
+import pytest
+from django.db import connection
+
+from factories import factories as f
+from karspexet.ticket.models import Reservation, Voucher
+from karspexet.venue.models import Seat
+
+
+def _plan(queryset) -> str:
+    # The test tables are tiny, so Postgres would rather scan them sequentially. Making sequential
+    # scans prohibitively expensive shows whether the query can be answered from an index at all.
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL enable_seqscan = off")
+    return queryset.explain()
+
+
+@pytest.mark.django_db
+class TestReservationIndexes:
+    def test_active_reservations_per_show(self, show):
+        plan = _plan(Reservation.active.filter(show=show))
+        assert "Seq Scan on ticket_reservation" not in plan
+
+    def test_held_seats_of_a_show(self, show):
+        plan = _plan(Seat.objects.available_seat_ids_query(show))
+        assert "Seq Scan on ticket_reservation" not in plan
+
+    def test_reservation_holding_a_seat(self, show):
+        seat = Seat.objects.first()
+        plan = _plan(Reservation.objects.filter(tickets__has_key=str(seat.id)))
+        assert "reservation_tickets_gin" in plan
+
+    def test_tickets_of_a_reservation(self, show):
+        reservation = f.CreateReservation(show=show, tickets={})
+        assert "Seq Scan on ticket_ticket" not in _plan(reservation.ticket_set.all())
+
+    def test_unused_vouchers(self):
+        plan = _plan(Voucher.objects.active())
+        assert "Seq Scan on ticket_discount" not in plan
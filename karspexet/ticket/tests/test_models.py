@@ -1,18 +1,26 @@
+import io
 from datetime import date, datetime
 from unittest.mock import patch
 
 import pytest
 from dateutil.relativedelta import relativedelta
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from factories import factories as f
+from karspexet.show.models import Show
 from karspexet.ticket.models import (
     AlreadyDiscountedException,
     InvalidVoucherException,
     PricingModel,
     Reservation,
+    ReservationSeat,
+    SalesSummary,
+    SeatAlreadyHeldException,
     Ticket,
     Voucher,
 )
@@ -79,6 +87,42 @@ class TestReservation(TestCase):
 
         assert reservation.total == 450
 
+    def test_hold_seats_rejects_seats_held_by_another_reservation(self):
+        timestamp = timezone.now() + relativedelta(minutes=10)
+        holder = Reservation.objects.create(
+            show=self.show,
+            session_timeout=timestamp,
+            tickets={str(self.seat1.id): 'normal'},
+        )
+        holder.hold_seats()
+        reservation = Reservation.objects.create(
+            show=self.show,
+            session_timeout=timestamp,
+            tickets={str(self.seat1.id): 'student', str(self.seat2.id): 'normal'},
+        )
+
+        with pytest.raises(SeatAlreadyHeldException):
+            reservation.hold_seats()
+
+        assert list(ReservationSeat.objects.values_list('reservation', 'seat')) == [(holder.id, self.seat1.id)]
+
+    def test_hold_seats_releases_holds_of_expired_reservations(self):
+        expired = Reservation.objects.create(
+            show=self.show,
+            session_timeout=timezone.now() - relativedelta(minutes=1),
+            tickets={str(self.seat1.id): 'normal'},
+        )
+        expired.hold_seats()
+        reservation = Reservation.objects.create(
+            show=self.show,
+            session_timeout=timezone.now() + relativedelta(minutes=10),
+            tickets={str(self.seat1.id): 'student'},
+        )
+
+        reservation.hold_seats()
+
+        assert list(ReservationSeat.objects.values_list('reservation', 'ticket_type')) == [(reservation.id, 'student')]
+
     def test_reservations_have_auto_generated_reservation_code(self):
         reservation_1 = Reservation()
         reservation_2 = Reservation()
@@ -128,6 +172,41 @@ class TestPricingModel(TestCase):
         assert seat.price_for_type('student') == 200
         assert seat.price_for_type('student', one_day_ago) == 150
 
+    def test_price_table_resolves_like_price_for_type(self):
+        PricingModel.objects.create(
+            seating_group=self.group,
+            valid_from=timezone.now() - relativedelta(days=2),
+            prices={'student': 150, 'normal': 200},
+        )
+        PricingModel.objects.create(
+            seating_group=self.group,
+            valid_from=timezone.now(),
+            prices={'student': 200, 'normal': 250},
+        )
+        one_day_ago = timezone.now() - relativedelta(days=1)
+
+        table = PricingModel.objects.price_table(self.group.venue_id)
+
+        assert table.price_for(self.group.id, 'student') == 200
+        assert table.price_for(self.group.id, 'student', one_day_ago) == 150
+        assert table.prices_for(self.group.id, timezone.now() - relativedelta(days=3)) is None
+
+    def test_price_table_is_reloaded_when_a_pricing_model_is_saved(self):
+        pricing = PricingModel.objects.create(
+            seating_group=self.group,
+            valid_from=timezone.now(),
+            prices={'student': 200, 'normal': 250},
+        )
+        assert PricingModel.objects.price_table(self.group.venue_id).price_for(self.group.id, 'student') == 200
+
+        with self.assertNumQueries(1):
+            PricingModel.objects.price_table(self.group.venue_id)
+
+        pricing.prices['student'] = 180
+        pricing.save()
+
+        assert PricingModel.objects.price_table(self.group.venue_id).price_for(self.group.id, 'student') == 180
+
 
 class TestTicket(TestCase):
     def setUp(self):
@@ -173,6 +252,16 @@ class TestDiscount:
         assert discount.amount == reservation.ticket_price
         assert reservation.total == 0
 
+    def test_used_vouchers_are_not_active(self, show, user):
+        seat = Seat.objects.first()
+        reservation = f.CreateReservation(tickets={str(seat.id): 'normal'}, show=show)
+        # Create a few vouchers first, so the voucher ids and discount ids don't line up
+        unused = [Voucher.objects.create(amount=100, created_by=user) for _ in range(3)]
+        used = Voucher.objects.create(amount=100, created_by=user)
+        reservation.apply_voucher(used.code)
+
+        assert set(Voucher.objects.active()) == set(unused)
+
     def test_excess_voucher_amount_is_void(self, show, user):
         seat = Seat.objects.first()
         tickets = {str(seat.id): 'normal'}
@@ -234,3 +323,33 @@ class TestDiscount:
         with patch("karspexet.ticket.models.timezone.now", return_value=end_of_year):
             voucher = Voucher(amount=100, created_by=user)
             assert voucher.expiry_date == date(next_year, 9, 15)
+
+
+@pytest.mark.django_db
+class TestSalesSummary:
+    def test_rebuild_matches_live_aggregation(self, show, user):
+        seats = list(Seat.objects.all())
+        account = f.CreateAccount()
+        f.CreateTicket(show=show, seat=seats[0], account=account, price=250, ticket_type="normal")
+        f.CreateTicket(show=show, seat=seats[1], account=account, price=200, ticket_type="student")
+        reservation = f.CreateReservation(show=show, tickets={str(seats[0].id): "normal"}, finalized=True)
+        f.CreateDiscount(reservation=reservation, amount=100)
+        SalesSummary.objects.create(show=show, ticket_count=99)
+
+        call_command("rebuild_sales_summaries", stdout=io.StringIO())
+
+        summary = Show.objects.annotate_sales_summary().get(pk=show.pk)
+        live = Show.objects.annotate_ticket_coverage().get(pk=show.pk)
+        for field in ["ticket_count", "normal_count", "student_count", "sponsor_count", "revenue", "discount_total"]:
+            assert getattr(summary, field) == getattr(live, field), field
+        assert summary.sales_percentage == live.sales_percentage == 100
+        assert SalesSummary.objects.get(show=show).last_sale_at is not None
+
+    def test_rebuild_aggregates_under_the_summary_table_lock(self):
+        with CaptureQueriesContext(connection) as queries:
+            SalesSummary.objects.rebuild()
+
+        statements = [query["sql"] for query in queries.captured_queries]
+        lock = next(i for i, sql in enumerate(statements) if sql.startswith("LOCK TABLE"))
+        aggregation = next(i for i, sql in enumerate(statements) if '"ticket_ticket"' in sql)
+        assert lock < aggregation
@@ -1,21 +1,35 @@
+import os
 from unittest import mock
 
 import pytest
 import stripe
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.core import mail
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from factories import factories as f
 from karspexet.ticket import views
-from karspexet.ticket.models import Reservation, Seat, Ticket
+from karspexet.ticket.models import (
+    Reservation,
+    SalesSummary,
+    Seat,
+    SeatsOccupiedException,
+    StripeEvent,
+    Ticket,
+    Voucher,
+)
 from karspexet.ticket.payment import (
     get_payment_intent_from_reservation,
     handle_stripe_webhook,
     handle_successful_payment,
+    process_stripe_events,
 )
+from karspexet.ticket.pdf import ticket_pdf_path
+from karspexet.ticket.tasks import send_queued_emails
 
 
 @pytest.mark.django_db
@@ -30,6 +44,15 @@ class TestPaymentSuccess:
         reservation.refresh_from_db()
         assert reservation.finalized
 
+    def test_links_issued_tickets_to_the_reservation(self, show):
+        reservation = self._build_reservation(show)
+        handle_successful_payment(reservation, {"name": "Frank Hamer", "email": "frank@hamer.com"})
+
+        tickets = Ticket.objects.filter(show=show)
+        assert {t.seat_id for t in tickets} == {int(seat_id) for seat_id in reservation.tickets}
+        assert all(t.get_reservation() == reservation for t in tickets)
+        assert list(reservation.ticket_set.order_by("pk")) == list(tickets.order_by("pk"))
+
     def test_handle_missing_reservations_without_crashing(self, show):
         r_id = 1
         assert not Reservation.objects.filter(id=r_id).exists()
@@ -45,6 +68,7 @@ class TestPaymentSuccess:
         # Handle the same webhook twice to make sure we handle it idempotently
         handle_successful_payment(reservation, data)
         handle_successful_payment(reservation, data)
+        send_queued_emails()
 
         reservation.refresh_from_db()
         assert reservation.finalized
@@ -55,12 +79,14 @@ class TestPaymentSuccess:
         assert Ticket.objects.count() == 1
 
     @mock.patch("karspexet.ticket.payment.send_ticket_email_to_customer", autospec=True, side_effect=Exception)
-    def test_finalizes_reservation_even_with_email_error(self, _, show):
+    def test_queues_email_in_the_same_transaction_as_the_tickets(self, _, show):
         reservation = self._build_reservation(show)
         with pytest.raises(Exception):
             handle_successful_payment(reservation, {"name": "mayor", "email": "mayor"})
+        # Nothing is saved, so the payment is handled again when the event is retried
         reservation.refresh_from_db()
-        assert reservation.finalized
+        assert not reservation.finalized
+        assert not Ticket.objects.exists()
 
     def _build_reservation(self, show):
         seat = Seat.objects.first()
@@ -77,6 +103,100 @@ class TestPaymentSuccess:
         handle_successful_payment(reservation, data, reference="Hank Framer")
         assert Ticket.objects.first().reference == "Hank Framer"
 
+    def test_issues_tickets_with_constant_number_of_queries(self, show, django_assert_num_queries):
+        group = Seat.objects.first().group
+        data = {"name": "Frank Hamer", "email": "frank@hamer.com"}
+        f.CreateAccount(phone="", **data)
+        # Warm up per-process caches used when sending the email
+        handle_successful_payment(self._build_reservation(show), data)
+
+        small = f.CreateReservation(tickets={str(f.CreateSeat(group=group).id): "normal"}, show=show)
+        with CaptureQueriesContext(connection) as small_queries:
+            handle_successful_payment(small, data)
+
+        seats = [f.CreateSeat(group=group) for _ in range(10)]
+        large = f.CreateReservation(tickets={str(seat.id): "student" for seat in seats}, show=show)
+        with django_assert_num_queries(len(small_queries)):
+            handle_successful_payment(large, data)
+
+        assert Ticket.objects.filter(seat__in=seats, price=200).count() == 10
+
+    def test_updates_sales_summary(self, show, user):
+        seats = list(Seat.objects.all())
+        data = {"name": "Frank Hamer", "email": "frank@hamer.com"}
+
+        first = f.CreateReservation(tickets={str(seats[0].id): "normal"}, show=show)
+        handle_successful_payment(first, data)
+
+        second = f.CreateReservation(tickets={str(seats[1].id): "student"}, show=show)
+        second.apply_voucher(Voucher.objects.create(amount=50, created_by=user).code)
+        second.save()
+        handle_successful_payment(second, data)
+
+        summary = SalesSummary.objects.get(show=show)
+        assert (summary.ticket_count, summary.normal_count, summary.student_count) == (2, 1, 1)
+        assert summary.revenue == 450
+        assert summary.discount_total == 50
+        assert summary.last_sale_at is not None
+
+    def test_reports_every_occupied_seat(self, show):
+        seats = list(Seat.objects.all())
+        reservation = f.CreateReservation(tickets={str(seat.id): "normal" for seat in seats}, show=show)
+        account = f.CreateAccount()
+        for seat in seats:
+            f.CreateTicket(show=show, seat=seat, account=account)
+
+        with pytest.raises(SeatsOccupiedException) as exc_info:
+            handle_successful_payment(reservation, {"name": "Frank Hamer", "email": "frank@hamer.com"})
+
+        assert exc_info.value.seat_ids == sorted(seat.id for seat in seats)
+        reservation.refresh_from_db()
+        assert not reservation.finalized
+
+
+@pytest.mark.django_db
+class TestProcessStripeEvents:
+    def test_processes_received_event_once(self, show):
+        reservation = f.CreateReservation(tickets={str(Seat.objects.first().id): "normal"}, show=show)
+        event = _stripe_event(metadata={"reservation_id": reservation.id})
+        assert StripeEvent.objects.record(event)
+        assert not StripeEvent.objects.record(event)
+
+        with mock.patch("karspexet.ticket.payment.stripe.PaymentMethod") as payment_method:
+            payment_method.retrieve.return_value = FakeIntent(reservation)
+            assert process_stripe_events() == 1
+            assert process_stripe_events() == 0
+
+        reservation.refresh_from_db()
+        assert reservation.finalized
+        assert StripeEvent.objects.get().processed_at is not None
+
+    def test_pregenerates_ticket_pdfs(self, show, settings, django_capture_on_commit_callbacks):
+        reservation = f.CreateReservation(tickets={str(Seat.objects.first().id): "normal"}, show=show)
+        StripeEvent.objects.record(_stripe_event(metadata={"reservation_id": reservation.id}))
+
+        with mock.patch("karspexet.ticket.payment.stripe.PaymentMethod") as payment_method:
+            payment_method.retrieve.return_value = FakeIntent(reservation)
+            with django_capture_on_commit_callbacks(execute=True):
+                process_stripe_events()
+
+        ticket = Ticket.objects.get()
+        assert os.path.exists(ticket_pdf_path(reservation, ticket))
+        assert len(os.listdir(settings.TICKET_PDF_CACHE_DIR)) == 1
+
+    def test_retries_failed_event_later(self, show):
+        StripeEvent.objects.record(_stripe_event())
+
+        with mock.patch("karspexet.ticket.payment.handle_stripe_webhook", side_effect=ValueError("boom")):
+            assert process_stripe_events() == 0
+
+        stripe_event = StripeEvent.objects.get()
+        assert stripe_event.attempts == 1
+        assert stripe_event.processed_at is None
+        assert "boom" in stripe_event.last_error
+        assert stripe_event.process_after > timezone.now()
+        assert not StripeEvent.objects.pending().exists()
+
 
 @pytest.mark.django_db
 class TestGetPaymentIntentFromReservation:
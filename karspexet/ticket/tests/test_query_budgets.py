@@ -0,0 +1,78 @@
+import pytest
+from django.shortcuts import reverse
+from django.utils import timezone
+
+from factories import factories as f
+from karspexet.ticket.payment import handle_successful_payment
+from karspexet.venue.models import Seat
+
+# The budgets must not depend on the size of the venue or the reservation, so every view is
+# exercised with a small and a large one
+pytestmark = [pytest.mark.django_db, pytest.mark.parametrize("num_seats", [2, 40])]
+
+
+@pytest.fixture
+def show(num_seats):
+    venue = f.CreateVenue(num_seats=num_seats)
+    return f.CreateShow(venue=venue, date=timezone.now() + timezone.timedelta(days=7), visible=True)
+
+
+@pytest.fixture
+def reservation(show):
+    seats = Seat.objects.filter(group__venue=show.venue)
+    reservation = f.CreateReservation(show=show, tickets={str(seat.id): "normal" for seat in seats})
+    handle_successful_payment(reservation, {"name": "Frank Hamer", "email": "frank@hamer.com"})
+    return reservation
+
+
+def _hold_seats(client, show):
+    seats = Seat.objects.filter(group__venue=show.venue)
+    data = {f"seat_{seat.id}": "normal" for seat in seats}
+    data["email"] = "frank@hamer.com"
+    return client.post(reverse("select_seats", args=[show.id]), data=data)
+
+
+def test_home(client, show, query_budget):
+    response = client.get(reverse("ticket_home"))
+    query_budget(response, 12)
+
+
+def test_select_seats(client, show, query_budget):
+    response = client.get(reverse("select_seats", args=[show.id]))
+    query_budget(response, 21)
+
+
+def test_hold_seats(client, show, query_budget):
+    response = _hold_seats(client, show)
+    assert response.status_code == 302
+    query_budget(response, 29)
+
+
+def test_booking_overview(client, show, query_budget):
+    _hold_seats(client, show)
+    response = client.get(reverse("booking_overview", args=[show.id]))
+    assert response.status_code == 200
+    query_budget(response, 17)
+
+
+def test_reservation_detail(client, reservation, query_budget):
+    response = client.get(reverse("reservation_detail", args=[reservation.reservation_code]))
+    query_budget(response, 14)
+
+
+def test_ticket_detail(client, reservation, query_budget):
+    ticket = reservation.ticket_set.first()
+    response = client.get(reverse("ticket_detail", args=[reservation.id, ticket.ticket_code]))
+    query_budget(response, 12)
+
+
+def test_ticket_qr_code(client, reservation, query_budget):
+    ticket = reservation.ticket_set.first()
+    response = client.get(reverse("ticket_qr_code", args=[reservation.id, ticket.ticket_code]))
+    query_budget(response, 7)
+
+
+def test_ticket_pdf(client, reservation, query_budget):
+    ticket = reservation.ticket_set.first()
+    response = client.get(reverse("ticket_pdf", args=[reservation.id, ticket.ticket_code]))
+    query_budget(response, 12)
@@ -0,0 +1,87 @@
+import random
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import connection, transaction
+from django.shortcuts import reverse
+from django.test import Client
+from django.utils import timezone
+
+from factories import factories as f
+from karspexet.ticket.models import (
+    Reservation,
+    ReservationSeat,
+    SeatAlreadyHeldException,
+)
+from karspexet.venue.models import Seat
+
+CLAIMERS = 100
+# Enough threads to have plenty of claims in flight, without running out of database connections
+WORKERS = 20
+
+
+def _in_thread(fn):
+    def run(*args):
+        try:
+            return fn(*args)
+        finally:
+            connection.close()
+
+    return run
+
+
+def _double_holds(show) -> list[str]:
+    holders = Counter()
+    for tickets in Reservation.objects.filter(show=show).exclude(tickets={}).values_list("tickets", flat=True):
+        holders.update(tickets.keys())
+    return [seat_id for seat_id, count in holders.items() if count > 1]
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentSeatClaims:
+    def test_parallel_claims_of_overlapping_seats(self):
+        show = f.CreateShow(venue=f.CreateVenue(num_seats=30))
+        seat_ids = list(Seat.objects.values_list("id", flat=True))
+        timeout = timezone.now() + timezone.timedelta(minutes=10)
+        reservations = [
+            Reservation.objects.create(show=show, tickets={}, session_timeout=timeout) for _ in range(CLAIMERS)
+        ]
+
+        @_in_thread
+        def claim(reservation):
+            rng = random.Random(reservation.id)
+            with transaction.atomic():
+                # Customers click their seats on the seat map in any order
+                reservation.tickets = {str(seat_id): "normal" for seat_id in rng.sample(seat_ids, 3)}
+                try:
+                    reservation.hold_seats()
+                except SeatAlreadyHeldException:
+                    return False
+                reservation.save()
+                return True
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            claimed = list(executor.map(claim, reservations))
+
+        assert any(claimed)
+        assert not _double_holds(show)
+        for reservation, succeeded in zip(reservations, claimed):
+            holds = set(ReservationSeat.objects.filter(reservation=reservation).values_list("seat_id", flat=True))
+            assert holds == ({int(seat_id) for seat_id in reservation.tickets} if succeeded else set())
+
+    def test_parallel_free_seating_orders_retry_with_other_seats(self):
+        show = f.CreateShow(venue=f.CreateVenue(num_seats=150), free_seating=True)
+        url = reverse("select_seats", args=[show.id])
+
+        @_in_thread
+        def order(number):
+            response = Client().post(url, data={"normal": 1, "email": f"kund{number}@example.com"})
+            return response.status_code == 302
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            ordered = list(executor.map(order, range(CLAIMERS)))
+
+        assert all(ordered)
+        assert not _double_holds(show)
+        assert ReservationSeat.objects.filter(show=show).count() == CLAIMERS
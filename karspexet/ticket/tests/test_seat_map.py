@@ -0,0 +1,88 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase
+
+from factories import factories as f
+from karspexet.ticket.seat_map import seat_map_svg, seat_selection
+from karspexet.venue.models import Venue
+
+
+class TestSeatSelection(TestCase):
+    def test_is_cached(self):
+        venue = f.CreateVenue(num_seats=2)
+        seat_selection(venue, free_seating=False)
+
+        with self.assertNumQueries(0):
+            pricings, payload = seat_selection(venue, free_seating=False)
+
+        assert len(json.loads(payload)["allSeats"]) == 2
+        assert json.loads(payload)["freeSeating"] is False
+
+    def test_free_seating_only_has_the_prices_of_one_group(self):
+        venue = f.CreateVenue(num_seats=1)
+
+        pricings, payload = seat_selection(venue, free_seating=True)
+
+        assert pricings == {"normal": "250", "student": "200", "sponsor": None}
+        assert json.loads(payload)["pricings"] == pricings
+
+    def test_saving_a_seat_invalidates_the_cache(self):
+        venue = f.CreateVenue(num_seats=1)
+        seat_selection(venue, free_seating=False)
+
+        f.CreateSeat(group=venue.seatinggroup_set.get())
+
+        venue.refresh_from_db()
+        _, payload = seat_selection(venue, free_seating=False)
+        assert len(json.loads(payload)["allSeats"]) == 2
+
+    def test_saving_a_pricing_model_invalidates_the_cache(self):
+        venue = f.CreateVenue(num_seats=1)
+        group = venue.seatinggroup_set.get()
+        seat_selection(venue, free_seating=False)
+
+        pricing = group.pricingmodel_set.get()
+        pricing.prices["normal"] = 300
+        pricing.save()
+
+        venue.refresh_from_db()
+        pricings, _ = seat_selection(venue, free_seating=False)
+        assert pricings[group.id]["normal"] == "300"
+
+
+class TestSeatMapSvg(TestCase):
+    def test_renders_all_seats_in_one_query(self):
+        venue = f.CreateVenue(num_seats=3)
+        venue.refresh_from_db()
+
+        with self.assertNumQueries(1):
+            svg = seat_map_svg(venue)
+
+        assert svg.count('class="seat"') == 3
+
+    def test_is_cached_in_memory_and_on_disk(self):
+        venue = f.CreateVenue(num_seats=1)
+        venue.refresh_from_db()
+        svg = seat_map_svg(venue)
+
+        with self.assertNumQueries(0):
+            assert seat_map_svg(venue) == svg
+
+        cache.clear()
+        with self.assertNumQueries(0):
+            assert seat_map_svg(venue) == svg
+        assert os.listdir(settings.SEAT_MAP_CACHE_DIR) == [f"venue-{venue.id}-{venue.layout_version}.svg"]
+
+    def test_new_seats_give_a_new_seat_map(self):
+        venue = f.CreateVenue(num_seats=1)
+        venue.refresh_from_db()
+        seat_map_svg(venue)
+
+        f.CreateSeat(group=venue.seatinggroup_set.get())
+
+        venue = Venue.objects.get(pk=venue.pk)
+        assert seat_map_svg(venue).count('class="seat"') == 2
+        assert len(os.listdir(settings.SEAT_MAP_CACHE_DIR)) == 1
@@ -0,0 +1,169 @@
+import io
+import os
+from datetime import timedelta
+from smtplib import SMTPException
+from unittest import mock
+
+import pytest
+from django.core import mail
+from django.core.management import call_command
+from django.utils import timezone
+
+from factories import factories as f
+from karspexet.ticket.models import OutgoingEmail, Reservation, ReservationSeat
+from karspexet.ticket.tasks import (
+    delete_expired_reservations,
+    send_queued_emails,
+    send_ticket_email_to_customer,
+)
+from karspexet.venue.models import Seat
+
+
+@pytest.mark.django_db
+class TestSendTicketEmailToCustomer:
+    def test_queues_email_instead_of_sending_it(self):
+        reservation = f.CreateReservationWithTicket()
+
+        send_ticket_email_to_customer(reservation, "bonnie@example.com")
+
+        assert mail.outbox == []
+        email = OutgoingEmail.objects.get()
+        assert email.recipient == "bonnie@example.com"
+        assert reservation.reservation_code in email.body
+
+    def test_ignores_missing_email(self):
+        send_ticket_email_to_customer(f.CreateReservationWithTicket(), "")
+        assert not OutgoingEmail.objects.exists()
+
+
+@pytest.mark.django_db
+class TestSendQueuedEmails:
+    def test_sends_batch_over_one_connection(self):
+        for i in range(3):
+            _queue_email(f"clyde{i}@example.com")
+
+        with mock.patch("karspexet.ticket.tasks.get_connection", wraps=mail.get_connection) as get_connection:
+            assert send_queued_emails() == 3
+
+        get_connection.assert_called_once()
+        assert sorted(m.to[0] for m in mail.outbox) == ["clyde0@example.com", "clyde1@example.com", "clyde2@example.com"]
+        assert not OutgoingEmail.objects.pending().exists()
+        assert send_queued_emails() == 0
+
+    def test_retries_failed_email_with_backoff(self):
+        email = _queue_email("bonnie@example.com")
+
+        with mock.patch("django.core.mail.EmailMessage.send", side_effect=SMTPException("busy")):
+            assert send_queued_emails() == 0
+
+        email.refresh_from_db()
+        assert email.attempts == 1
+        assert email.sent_at is None
+        assert "busy" in email.last_error
+        assert email.send_after > timezone.now()
+        assert send_queued_emails() == 0
+
+        OutgoingEmail.objects.filter(pk=email.pk).update(send_after=timezone.now())
+        assert send_queued_emails() == 1
+        assert len(mail.outbox) == 1
+
+    def test_backs_off_when_the_mail_server_is_unreachable(self):
+        email = _queue_email("bonnie@example.com")
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.open", side_effect=OSError("refused")):
+            assert send_queued_emails() == 0
+
+        email.refresh_from_db()
+        assert email.attempts == 1
+        assert "refused" in email.last_error
+        assert email.send_after > timezone.now()
+        assert send_queued_emails() == 0
+
+    def test_leases_the_batch_while_sending(self):
+        email = _queue_email("bonnie@example.com")
+
+        def send(message):
+            # Another worker looking at the queue meanwhile finds nothing to send
+            assert not OutgoingEmail.objects.pending().exists()
+            return 1
+
+        with mock.patch("django.core.mail.backends.locmem.EmailBackend.send_messages", side_effect=send):
+            assert send_queued_emails() == 1
+
+        email.refresh_from_db()
+        assert email.sent_at is not None
+
+    def test_gives_up_after_max_attempts(self):
+        email = _queue_email("bonnie@example.com")
+        OutgoingEmail.objects.filter(pk=email.pk).update(attempts=OutgoingEmail.MAX_ATTEMPTS)
+
+        assert send_queued_emails() == 0
+        assert mail.outbox == []
+
+    def test_command_sends_once(self):
+        _queue_email("bonnie@example.com")
+        call_command("send_queued_emails", "--once")
+        assert len(mail.outbox) == 1
+
+
+@pytest.mark.django_db
+class TestDeleteExpiredReservations:
+    def test_deletes_only_abandoned_reservations(self, show):
+        seat = Seat.objects.first()
+        long_ago = timezone.now() - timedelta(days=2)
+        abandoned = f.CreateReservation(show=show, tickets={str(seat.id): "normal"}, session_timeout=long_ago)
+        abandoned.hold_seats()
+        paid = f.CreateReservation(show=show, tickets={}, session_timeout=long_ago, finalized=True)
+        recent = f.CreateReservation(show=show, tickets={}, session_timeout=timezone.now() - timedelta(minutes=5))
+
+        assert delete_expired_reservations(timezone.now() - timedelta(days=1)) == 1
+
+        assert set(Reservation.objects.values_list("id", flat=True)) == {paid.id, recent.id}
+        assert not ReservationSeat.objects.exists()
+
+    def test_command_deletes_in_batches(self, show):
+        long_ago = timezone.now() - timedelta(days=2)
+        for _ in range(5):
+            f.CreateReservation(show=show, tickets={}, session_timeout=long_ago)
+
+        out = io.StringIO()
+        call_command("delete_expired_reservations", "--batch-size", "2", stdout=out)
+
+        assert not Reservation.objects.exists()
+        assert "Deleted 5 expired reservations" in out.getvalue()
+
+
+class TestDeleteOldTicketFiles:
+    def test_deletes_only_old_pdfs_and_qr_codes(self, settings):
+        long_ago = (timezone.now() - timedelta(days=40)).timestamp()
+        files = {
+            settings.TICKET_PDF_CACHE_DIR: ["old.pdf", "crashed.tmp", "recent.pdf", "README"],
+            settings.QR_CODE_CACHE_DIR: ["old.png", "old.svg", "crashed.tmp", "recent.svg"],
+        }
+        for directory, names in files.items():
+            os.makedirs(directory)
+            for name in names:
+                path = os.path.join(directory, name)
+                open(path, "w").close()
+                if not name.startswith("recent"):
+                    os.utime(path, (long_ago, long_ago))
+
+        out = io.StringIO()
+        call_command("delete_old_ticket_files", stdout=out)
+
+        assert sorted(os.listdir(settings.TICKET_PDF_CACHE_DIR)) == ["README", "recent.pdf"]
+        assert os.listdir(settings.QR_CODE_CACHE_DIR) == ["recent.svg"]
+        assert "Deleted 2 ticket PDFs and 3 QR codes" in out.getvalue()
+
+    def test_without_any_files(self, settings):
+        call_command("delete_old_ticket_files", stdout=io.StringIO())
+
+
+def _queue_email(recipient):
+    return OutgoingEmail.objects.create(
+        recipient=recipient,
+        from_email="biljett@karspexet.se",
+        subject="Biljetter",
+        body="Välkommen!",
+        send_after=timezone.now() - timedelta(seconds=1),
+    )
@@ -0,0 +1,26 @@
+import os
+from unittest import mock
+
+import pyqrcode
+
+from karspexet.ticket.utils import qr_code, qr_code_as_png_data_url
+
+
+class TestQrCode:
+    def setup_method(self):
+        qr_code.cache_clear()
+
+    def test_renders_png_and_svg(self):
+        assert qr_code("https://karspexet.se/", "png").startswith(b"\x89PNG")
+        assert b"<svg" in qr_code("https://karspexet.se/", "svg")
+        assert qr_code_as_png_data_url("https://karspexet.se/").startswith("data:image/png;base64,")
+
+    def test_is_stored_on_disk_and_memoized(self, settings):
+        url = "https://karspexet.se/biljett/"
+        with mock.patch("pyqrcode.create", wraps=pyqrcode.create) as create:
+            svg = qr_code(url, "svg")
+            assert qr_code(url, "svg") == svg
+            qr_code.cache_clear()
+            assert qr_code(url, "svg") == svg
+        create.assert_called_once()
+        assert len(os.listdir(settings.QR_CODE_CACHE_DIR)) == 1
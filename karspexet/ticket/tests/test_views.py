@@ -1,16 +1,23 @@
+import os
 from unittest import mock
 
 from django.conf import settings
 from importlib import import_module
 import pytest
+from dateutil import parser
 from django.contrib.sessions.middleware import SessionMiddleware
+from django.db import connection
+from django.http import Http404
 from django.shortcuts import reverse
 from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from xhtml2pdf import pisa
 
 from factories import factories as f
-from karspexet.ticket import views
-from karspexet.ticket.models import Discount, Reservation, Seat, TicketType, Voucher
+from karspexet.ticket import pdf, views
+from karspexet.ticket.models import Discount, Reservation, Seat, StripeEvent, TicketType, Voucher
+from karspexet.ticket.payment import handle_successful_payment
 
 
 class TestTicketViews(TestCase):
@@ -33,6 +40,16 @@ class TestTicketViews(TestCase):
         response = self.client.get(reverse(views.select_seats, args=[show.id]))
         self.assertContains(response, "Uppsättningen")
 
+    @override_settings(SERVER_TIMING=True)
+    def test_select_seats_reports_server_timing(self):
+        show = f.CreateShow()
+        response = self.client.get(reverse(views.select_seats, args=[show.id]))
+        metrics = response.metrics
+        assert metrics.queries > 0
+        assert 0 < metrics.db_time < metrics.total_time
+        assert 0 < metrics.template_time < metrics.total_time
+        assert f'db;desc="{metrics.queries} queries"' in response["Server-Timing"]
+
     def test_select_seats_picks_automatic_seats_with_free_seating(self):
         show = f.CreateShow(free_seating=True, venue__num_seats=5)
         f.CreateTicket(seat=Seat.objects.first(), show=show)
@@ -55,10 +72,21 @@ class TestTicketViews(TestCase):
             "student": 2,
             "email": "bonnie@example.com",
         }
-        response = self.client.post(url, data=data, follow=False)
+        response = self.client_class().post(url, data=data, follow=False)
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "Det finns inte tillräckligt många biljetter kvar.")
 
+    def test_free_seating_order_can_be_changed_to_use_its_own_seats(self):
+        show = f.CreateShow(free_seating=True, venue__num_seats=3)
+        url = reverse(views.select_seats, args=[show.id])
+        self.client.post(url, data={TicketType.normal: 2, "email": "frank@example.com"})
+
+        # Frank changes their mind and wants all seats, including the two they already hold
+        response = self.client.post(url, data={TicketType.normal: 3, "email": "frank@example.com"})
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(Reservation.objects.get().tickets), 3)
+
     def test_reservation_detail(self):
         reservation = f.CreateReservationWithTicket()
         url = reverse(views.reservation_detail, args=[reservation.reservation_code])
@@ -89,12 +117,97 @@ class TestSelectSeats(TestCase):
         reservation = Reservation.objects.get()
         assert reservation.tickets == {str(seat.id): "normal"}
 
+    def test_rejects_seats_held_by_another_reservation(self):
+        seat = Seat.objects.first()
+        holder = f.CreateReservation(
+            show=self.show,
+            tickets={str(seat.id): "normal"},
+            session_timeout=timezone.now() + timezone.timedelta(minutes=10),
+        )
+        holder.hold_seats()
+
+        response = self.client.post(self.url, data={f"seat_{seat.id}": "normal"})
+        self.assertContains(response, "Vissa av platserna du valde har redan blivit bokade av någon annan")
+        assert not Reservation.objects.exclude(pk=holder.pk).get().tickets
+
+    def test_marks_seats_reserved_by_others_as_taken(self):
+        seat = Seat.objects.first()
+        f.CreateReservation(
+            show=self.show,
+            tickets={str(seat.id): "normal"},
+            session_timeout=timezone.now() + timezone.timedelta(minutes=10),
+        )
+
+        response = self.client.get(self.url)
+        self.assertContains(response, f'data-taken-seats="{seat.id}"')
+        self.assertContains(response, f'id="seat-{seat.id}"')
+
+    def test_saves_the_session_and_reservation_only_when_they_change(self):
+        seat = Seat.objects.first()
+        self.client.post(self.url, data={f"seat_{seat.id}": "normal"})
+        # The CMS fills its caches on the first request
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url)
+        assert not [q["sql"] for q in queries if q["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+
+        # Until the timeouts lag behind by more than the slack
+        lagging = timezone.now() + timezone.timedelta(minutes=25)
+        Reservation.objects.update(session_timeout=lagging)
+        session = self.client.session
+        session["reservation_timeout"] = lagging.isoformat()
+        session.save()
+        self.client.get(self.url)
+        refreshed = timezone.now() + timezone.timedelta(minutes=29)
+        assert parser.parse(self.client.session["reservation_timeout"]) > refreshed
+        assert Reservation.objects.get().session_timeout > refreshed
+
     def test_with_finalized_reservation_in_session_gives_new_reservation(self):
         show = self.show
         reservation = f.CreateReservationWithTicket(show=show, finalized=True)
+        session = self.client.session
+        session[f"show_{show.id}"] = reservation.id
+        session.save()
+
+        seat = Seat.objects.first()
+        self.client.post(self.url, data={f"seat_{seat.id}": "normal"})
+        assert self.client.session[f"show_{show.id}"] != reservation.id
+        assert Reservation.objects.get(finalized=False).tickets == {str(seat.id): "normal"}
+
+    def test_expired_reservation_is_not_revived_after_its_seat_was_taken(self):
+        seat = Seat.objects.first()
+        self.client.post(self.url, data={f"seat_{seat.id}": "normal"})
+        expired = Reservation.objects.get()
+        Reservation.objects.update(session_timeout=timezone.now() - timezone.timedelta(minutes=1))
+        # Bonnie takes over the seat, which frees the expired hold
+        response = self.client_class().post(self.url, data={f"seat_{seat.id}": "normal"})
+        assert response.status_code == 302
 
-        response = self.client.get(self.url, session={f"show_{show.id}": reservation.id})
-        assert response._request.session[f"show_{show.id}"] != reservation.id
+        self.client.get(self.url)
+        response = self.client.get(reverse(views.booking_overview, args=[self.show.id]))
+
+        assert response["Location"] == self.url
+        expired.refresh_from_db()
+        assert expired.session_timeout < timezone.now()
+        assert Reservation.active.get().tickets == {str(seat.id): "normal"}
+
+    def test_looking_at_the_seat_map_writes_nothing(self):
+        # The CMS fills its caches on the first request
+        self.client.get(self.url)
+        self.client.cookies.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        assert response.status_code == 200
+        assert not [q["sql"] for q in queries if q["sql"].startswith(("INSERT", "UPDATE", "DELETE"))]
+        assert not Reservation.objects.exists()
+        assert "sessionid" not in response.cookies
+
+    def test_booking_overview_without_reservation_redirects_to_the_seat_map(self):
+        response = self.client.get(reverse(views.booking_overview, args=[self.show.id]))
+        assert response.status_code == 302
+        assert response["Location"] == self.url
+        assert not Reservation.objects.exists()
 
 
 class TestBookingOverview(TestCase):
@@ -111,7 +224,9 @@ class TestBookingOverview(TestCase):
     @override_settings(PAYMENT_PROCESS="stripe")
     def test_booking_overview_with_active_session__includes_payment_intent(self):
         show = self.show
-        reservation = f.CreateReservationWithTicket(show=show)
+        reservation = f.CreateReservationWithTicket(
+            show=show, session_timeout=timezone.now() + timezone.timedelta(minutes=10)
+        )
         self._add_reservation_to_session(reservation)
 
         mock_payment_intent = object()
@@ -128,7 +243,9 @@ class TestBookingOverview(TestCase):
     @override_settings(PAYMENT_PROCESS="fake")
     def test_booking_overview_with_active_session__with_fake_intent(self):
         show = self.show
-        reservation = f.CreateReservationWithTicket(show=show)
+        reservation = f.CreateReservationWithTicket(
+            show=show, session_timeout=timezone.now() + timezone.timedelta(minutes=10)
+        )
         self._add_reservation_to_session(reservation)
 
         with mock.patch("karspexet.ticket.views.payment", autospec=True):
@@ -143,14 +260,24 @@ class TestWebhooks(TestCase):
         response = self._post(data="invalid")
         assert response.status_code == 400
 
-        with mock.patch("karspexet.ticket.views.payment", autospec=True) as spy:
-            response = self._post(data='{"type": "payment_intent.succeeded"}')
-            spy.handle_stripe_webhook.assert_called_once()
+        response = self._post(data='{"type": "payment_intent.succeeded"}')
+        assert response.status_code == 400
+
+        with mock.patch("karspexet.ticket.payment.handle_stripe_webhook", autospec=True) as spy:
+            response = self._post(data='{"id": "evt_1", "type": "payment_intent.succeeded"}')
+            spy.assert_not_called()
         assert response.status_code == 200
+        assert StripeEvent.objects.get().event_id == "evt_1"
 
-        response = self._post(data='{"type": "unknown"}')
+        response = self._post(data='{"id": "evt_2", "type": "unknown"}')
         assert response.status_code == 200
 
+    def test_stripe_webhooks_ignores_retried_events(self):
+        data = '{"id": "evt_1", "type": "payment_intent.succeeded"}'
+        assert self._post(data=data).status_code == 200
+        assert self._post(data=data).status_code == 200
+        assert StripeEvent.objects.count() == 1
+
     def _post(self, data):
         url = reverse(views.stripe_webhooks)
         return self.client.post(url, data=data, content_type="application/json")
@@ -178,19 +305,25 @@ def test_apply_voucher_with_active_reservation__updates_reservation_total(client
 
 
 @pytest.mark.django_db
-def test_process_payment(client, show):
+def test_process_payment(client, show, settings, django_capture_on_commit_callbacks):
     reservation = f.CreateReservationWithTicket(show=show)
     voucher = f.CreateVoucher(amount=reservation.total)
     discount = reservation.apply_voucher(voucher.code)
     reservation.save()
     assert reservation.is_free()
+    session = client.session
+    session[f"show_{show.id}"] = reservation.id
+    session.save()
 
     url = reverse(views.process_payment, args=[reservation.id])
-    response = client.post(url)
+    with django_capture_on_commit_callbacks(execute=True):
+        response = client.post(url)
     assert response.status_code == 302
     assert response["Location"] == reverse(views.reservation_detail, args=[reservation.reservation_code])
 
     assert Reservation.objects.get(pk=reservation.id).finalized
+    assert f"show_{show.id}" not in client.session
+    assert os.listdir(settings.TICKET_PDF_CACHE_DIR)
 
 
 @pytest.mark.django_db
@@ -205,21 +338,98 @@ def test_cancelling_a_discounted_reservation_allows_voucher_for_reuse(show, user
     assert Discount.objects.filter(pk=discount.id).count() == 0
 
 
+@pytest.mark.django_db
+def test_cancelling_a_paid_reservation_does_nothing(show):
+    reservation = f.CreateReservationWithTicket(show=show)
+    handle_successful_payment(reservation, {"name": "Frank Hamer", "email": "frank@hamer.com"})
+
+    response = _post(views.cancel_reservation, show.id, session={f"show_{show.id}": reservation.id})
+
+    assert response.status_code == 302
+    assert Reservation.objects.get(pk=reservation.id).finalized
+    assert reservation.ticket_set.count() == 1
+
+
 @pytest.mark.django_db
 class TestTickets:
     def test_ticket_detail(self, show):
         reservation = f.CreateReservationWithTicket(show=show)
-        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0])
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
         response = _get(views.ticket_detail, reservation.id, ticket.ticket_code)
         assert response.status_code == 200
+        assert response.context_data["qr_code"] == reverse(views.ticket_qr_code, args=[reservation.id, ticket.ticket_code])
+
+    def test_ticket_qr_code(self, show):
+        reservation = f.CreateReservationWithTicket(show=show)
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
+        response = _get(views.ticket_qr_code, reservation.id, ticket.ticket_code)
+        assert response.status_code == 200
+        assert response["Content-Type"] == "image/svg+xml"
+        assert "max-age" in response["Cache-Control"]
+        assert response.content.lstrip().startswith(b"<?xml")
+
+        with pytest.raises(Http404):
+            _get(views.ticket_qr_code, reservation.id, "unknown")
+
+    def test_ticket_qr_code_not_modified(self, show, client):
+        reservation = f.CreateReservationWithTicket(show=show)
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
+        url = reverse(views.ticket_qr_code, args=[reservation.id, ticket.ticket_code])
+
+        etag = client.get(url)["ETag"]
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
 
     def test_ticket_pdf(self, show):
         reservation = f.CreateReservationWithTicket(show=show)
-        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0])
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
         response = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)
         assert response.status_code == 200
         assert response["Content-Type"] == "application/pdf"
 
+    def test_ticket_pdf_is_rendered_once(self, show):
+        reservation = f.CreateReservationWithTicket(show=show)
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
+
+        with (
+            mock.patch("xhtml2pdf.pisa.CreatePDF", wraps=pisa.CreatePDF) as create_pdf,
+            mock.patch("karspexet.ticket.pdf._render_html", wraps=pdf._render_html) as render_html,
+        ):
+            first = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)
+            second = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)
+
+        create_pdf.assert_called_once()
+        render_html.assert_called_once()
+        assert first["ETag"] == second["ETag"]
+        assert b"".join(first.streaming_content) == b"".join(second.streaming_content)
+
+    def test_ticket_pdf_deleted_while_downloading_is_rendered_again(self, show, settings):
+        reservation = f.CreateReservationWithTicket(show=show)
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
+        etag = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)["ETag"]
+        for name in os.listdir(settings.TICKET_PDF_CACHE_DIR):
+            os.remove(os.path.join(settings.TICKET_PDF_CACHE_DIR, name))
+
+        # The PDF is deleted after the first check that it exists
+        checks = iter([True])
+        exists = os.path.exists
+        with mock.patch("karspexet.ticket.pdf.os.path.exists", side_effect=lambda path: next(checks, exists(path))):
+            response = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)
+
+        assert response.status_code == 200
+        assert response["ETag"] == etag
+        assert b"".join(response.streaming_content).startswith(b"%PDF")
+
+    def test_ticket_pdf_not_modified(self, show):
+        reservation = f.CreateReservationWithTicket(show=show)
+        ticket = f.CreateTicket(show=show, seat_id=list(reservation.tickets.keys())[0], reservation=reservation)
+        etag = _get(views.ticket_pdf, reservation.id, ticket.ticket_code)["ETag"]
+
+        url = reverse(views.ticket_pdf, args=[reservation.id, ticket.ticket_code])
+        request = RequestFactory().get(url, HTTP_IF_NONE_MATCH=etag)
+        response = views.ticket_pdf(request, reservation.id, ticket.ticket_code)
+        assert response.status_code == 304
+
 
 def _post(view, *args, data=None, session=None):
     request = RequestFactory().post(reverse(view, args=args), data=data)
@@ -15,4 +15,5 @@ urlpatterns = [
     path("stripe-webhooks/", views.stripe_webhooks),
     path("ticket/<reservation_id>-<ticket_code>.pdf", views.ticket_pdf, name="ticket_pdf"),
     path("ticket/<reservation_id>-<ticket_code>/", views.ticket_detail, name="ticket_detail"),
+    path("ticket/<reservation_id>-<ticket_code>/qr.svg", views.ticket_qr_code, name="ticket_qr_code"),
 ]
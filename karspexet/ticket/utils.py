@@ -1,12 +1,88 @@
 import base64
+import hashlib
 import io
+import os
+import tempfile
+from datetime import datetime
+from functools import lru_cache
 
 import pyqrcode
+from django.conf import settings
 
+QR_CODE_SCALE = 4
+QR_CODE_CONTENT_TYPES = {
+    "png": "image/png",
+    "svg": "image/svg+xml",
+}
 
-def qr_code_as_png_data_url(request):
-    buffer = io.BytesIO()
-    url = pyqrcode.create(request.build_absolute_uri())
-    url.png(buffer, scale=4)
-    encoded = base64.b64encode(buffer.getvalue())  # Creates a bytes object
+
+def qr_code_as_png_data_url(url: str):
+    encoded = base64.b64encode(qr_code(url, "png"))  # Creates a bytes object
     return "data:image/png;base64,{}".format(encoded.decode())
+
+
+def qr_code_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()
+
+
+@lru_cache(maxsize=1024)
+def qr_code(url: str, image_format: str = "png") -> bytes:
+    """
+    The QR code for the url, as a PNG or SVG image
+
+    The most recently used codes are kept in memory, and all of them on disk in
+    `settings.QR_CODE_CACHE_DIR` where they are shared by all workers, until they are
+    removed by the `delete_old_ticket_files` management command.
+    """
+    if image_format not in QR_CODE_CONTENT_TYPES:
+        raise ValueError(f"Unknown QR code format: {image_format}")
+
+    path = os.path.join(settings.QR_CODE_CACHE_DIR, f"{qr_code_key(url)}.{image_format}")
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    buffer = io.BytesIO()
+    code = pyqrcode.create(url)
+    if image_format == "svg":
+        code.svg(buffer, scale=QR_CODE_SCALE)
+    else:
+        code.png(buffer, scale=QR_CODE_SCALE)
+    image = buffer.getvalue()
+
+    os.makedirs(settings.QR_CODE_CACHE_DIR, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=settings.QR_CODE_CACHE_DIR, suffix=".tmp", delete=False) as f:
+        f.write(image)
+    os.replace(f.name, path)
+    return image
+
+
+def delete_old_qr_codes(created_before: datetime) -> int:
+    """
+    Delete the QR codes stored before the given time, they are created again when they are needed
+    """
+    return delete_old_files(settings.QR_CODE_CACHE_DIR, (".png", ".svg", ".tmp"), created_before)
+
+
+def delete_old_files(directory: str, suffixes: tuple[str, ...], modified_before: datetime) -> int:
+    """
+    Delete the files in the directory with one of the suffixes, last modified before the given time.
+    Returns the number of files deleted.
+    """
+    cutoff = modified_before.timestamp()
+    deleted = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if entry.name.endswith(suffixes) and entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Deleted by another run at the same time
+                continue
+            deleted += 1
+    return deleted
@@ -2,25 +2,35 @@ from __future__ import annotations
 
 import json
 import logging
+import os
 
 import stripe
 from django.conf import settings
 from django.contrib import messages
 from django.db import transaction
+from django.http import FileResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.template.response import HttpResponse, TemplateResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import etag, require_POST
 
 from karspexet.show.models import Show
 from karspexet.ticket import payment
 from karspexet.ticket.forms import ContactDetailsForm, CustomerEmailForm
 from karspexet.ticket.helpers import (
+    SEAT_CLAIM_ATTEMPTS,
     all_seats_available,
-    build_pricings_and_seats,
+    extend_reservation_timeout,
+    forget_reservation,
     get_or_create_reservation_object,
+    get_reservation_object,
     get_used_seats,
     payment_partial,
+    pick_free_seats,
     seat_specifications,
     session_expired,
     set_session_timeout,
@@ -31,14 +41,21 @@ from karspexet.ticket.models import (
     AlreadyDiscountedException,
     InvalidVoucherException,
     Reservation,
+    SeatAlreadyHeldException,
+    StripeEvent,
     Voucher,
 )
+from karspexet.ticket.pdf import open_ticket_pdf
+from karspexet.ticket.seat_map import seat_selection
 from karspexet.ticket.tasks import send_ticket_email_to_customer
-from karspexet.ticket.utils import qr_code_as_png_data_url
+from karspexet.ticket.utils import QR_CODE_CONTENT_TYPES, qr_code, qr_code_key
 from karspexet.venue.models import Seat
 
 logger = logging.getLogger(__name__)
 
+# The QR code of a ticket never changes, so browsers can keep it for a long time
+QR_CODE_MAX_AGE = 30 * 24 * 60 * 60
+
 
 def home(request):
     return TemplateResponse(request, "ticket/ticket.html", {
@@ -52,10 +69,12 @@ def stripe_webhooks(request):
     # https://stripe.com/docs/webhooks/build
 
     event = _parse_stripe_payload(request.body)
-    if event is None:
+    if event is None or not event.get("id"):
         return HttpResponse(status=400)
 
-    payment.handle_stripe_webhook(event)
+    # Acknowledge right away - the event is processed by the process_stripe_events command
+    if not StripeEvent.objects.record(event):
+        logger.info("Ignored already received Stripe Event=%s", event["id"])
     return HttpResponse(status=200)
 
 
@@ -80,19 +99,27 @@ def show_redirect(request, show_id: int):
 @transaction.atomic
 def select_seats(request, show_id: int):
     show: Show = get_object_or_404(Show, id=show_id)
-    reservation = get_or_create_reservation_object(request, show)
+    # Visitors who only look at the seat map don't get a reservation until they choose seats
+    if request.POST:
+        reservation = get_or_create_reservation_object(request, show)
+    else:
+        reservation = get_reservation_object(request, show)
+        if reservation:
+            extend_reservation_timeout(reservation)
 
-    taken_seats_qs = Reservation.active.exclude(pk=reservation.pk).filter(show=show)
-    set_session_timeout(request)
+    taken_seats_qs = Reservation.active.filter(show=show)
+    if reservation:
+        taken_seats_qs = taken_seats_qs.exclude(pk=reservation.pk)
+        set_session_timeout(request)
 
-    available_seats = Seat.objects.available_seats(show)
+    available_seats = Seat.objects.available_seats(show, reservation)
     contact_form = ContactDetailsForm(
         data=request.POST or None,
         initial={"reference": request.GET.get("referens")},
     )
 
     if request.POST:
-        if contact_form.is_valid():
+        if contact_form.is_valid() and request.session.get("contact_details") != contact_form.cleaned_data:
             request.session["contact_details"] = contact_form.cleaned_data
 
         if show.free_seating:
@@ -101,42 +128,40 @@ def select_seats(request, show_id: int):
             for price in prices:
                 requested_seats[price] = int(request.POST.get(price, 0) or 0)
             num_requested_seats = sum(requested_seats.values())
-            if num_requested_seats <= len(available_seats):
-                seats = {}
-                idx = 0
-                for price, num_seats in requested_seats.items():
-                    seats[price] = available_seats[idx:idx + num_seats]
-                    idx += num_seats
-
-                reservation.build_tickets(seats)
-                reservation.save()
-                return redirect("booking_overview", show_id=show.id)
-            else:
-                messages.error(request, "Det finns inte tillräckligt många biljetter kvar.")
+            for _ in range(SEAT_CLAIM_ATTEMPTS):
+                if num_requested_seats > len(available_seats):
+                    break
+                reservation.build_tickets(pick_free_seats(available_seats, requested_seats))
+                try:
+                    reservation.hold_seats()
+                except SeatAlreadyHeldException:
+                    # Someone claimed some of the seats after we looked them up, so try the ones left
+                    available_seats = Seat.objects.available_seats(show, reservation)
+                else:
+                    reservation.save()
+                    return redirect("booking_overview", show_id=show.id)
+            messages.error(request, "Det finns inte tillräckligt många biljetter kvar.")
 
         else:
             # Select seats from seatmap
             seat_params = seat_specifications(request)
-            if not all_seats_available(taken_seats_qs, seat_params.keys()):
+            if not all_seats_available(reservation, seat_params.keys()):
                 messages.error(request, "Vissa av platserna du valde har redan blivit bokade av någon annan")
             elif some_seat_is_missing_ticket_type(seat_params):
                 messages.error(request, "Du måste välja biljettyp för alla platser")
             else:
                 reservation.tickets = seat_params
-                reservation.save()
-                return redirect("booking_overview", show_id=show.id)
+                try:
+                    reservation.hold_seats()
+                except SeatAlreadyHeldException:
+                    messages.error(request, "Vissa av platserna du valde har redan blivit bokade av någon annan")
+                else:
+                    reservation.save()
+                    return redirect("booking_overview", show_id=show.id)
 
     taken_seats = set(map(int, set().union(*[r.tickets.keys() for r in taken_seats_qs.all()])))
 
-    pricings, seats = build_pricings_and_seats(show.venue)
-    if show.free_seating:
-        pricings = next(iter(pricings.values()), {})
-
-    seat_selection_json = json.dumps({
-        "allSeats": seats,
-        "pricings": pricings,
-        "freeSeating": show.free_seating,
-    })
+    pricings, seat_selection_json = seat_selection(show.venue, show.free_seating)
 
     return TemplateResponse(request, "ticket/select_seats.html", {
         'taken_seats': list(taken_seats),
@@ -157,18 +182,18 @@ def booking_overview(request, show_id: int):
             request, "Du har väntat för länge, så din bokning har tröttnat och gått och lagt sig. Du får börja om från början!")
         return redirect("select_seats", show_id=show.id)
 
-    set_session_timeout(request)
+    reservation = get_reservation_object(request, show)
+    if not reservation or not reservation.tickets:
+        messages.warning(request, "Du måste välja minst en plats")
+        return redirect("select_seats", show_id=show.id)
 
-    reservation = get_or_create_reservation_object(request, show)
+    extend_reservation_timeout(reservation)
+    set_session_timeout(request)
     if settings.PAYMENT_PROCESS != "stripe":
         payment_intent = {"client_secret": "not_stripe"}
     else:
         payment_intent = payment.get_payment_intent_from_reservation(request, reservation)
 
-    if not reservation.tickets:
-        messages.warning(request, "Du måste välja minst en plats")
-        return redirect("select_seats", show_id=show.id)
-
     seats = get_used_seats(reservation)
     contact_details = request.session.get("contact_details")
 
@@ -224,7 +249,7 @@ def process_payment(request, reservation_id: int):
 
     billing_data = request.POST
     reference = request.POST.get("reference", "")
-    payment.handle_successful_payment(reservation, billing_data, reference)
+    payment.handle_successful_payment(reservation, billing_data, reference, session=request.session)
     return redirect("reservation_detail", reservation_code=reservation.reservation_code)
 
 
@@ -237,14 +262,14 @@ def reservation_detail(request, reservation_code: str):
         'show': reservation.show,
         'venue': reservation.show.venue,
         'production': reservation.show.production,
-        'tickets': reservation.ticket_set(),
+        'tickets': reservation.ticket_set.select_related("seat__group"),
         'email_form': email_form,
     })
 
 
 def ticket_detail(request, reservation_id: int, ticket_code):
     reservation = Reservation.objects.get(pk=reservation_id)
-    ticket = reservation.ticket_set().get(ticket_code=ticket_code)
+    ticket = reservation.ticket_set.get(ticket_code=ticket_code)
 
     return TemplateResponse(request, "ticket_detail.html", {
         "reservation": reservation,
@@ -253,41 +278,51 @@ def ticket_detail(request, reservation_id: int, ticket_code):
         "production": reservation.show.production,
         "ticket": ticket,
         "seat": ticket.seat,
-        "qr_code": qr_code_as_png_data_url(request),
+        "qr_code": reverse("ticket_qr_code", args=[reservation_id, ticket_code]),
     })
 
 
+def _ticket_qr_code_url(request, reservation_id, ticket_code) -> str:
+    return request.build_absolute_uri(reverse("ticket_detail", args=[reservation_id, ticket_code]))
+
+
+@cache_control(public=True, max_age=QR_CODE_MAX_AGE)
+@etag(lambda request, reservation_id, ticket_code: qr_code_key(
+    _ticket_qr_code_url(request, reservation_id, ticket_code)
+))
+def ticket_qr_code(request, reservation_id: int, ticket_code):
+    reservation = get_object_or_404(Reservation, pk=reservation_id)
+    get_object_or_404(reservation.ticket_set, ticket_code=ticket_code)
+
+    svg = qr_code(_ticket_qr_code_url(request, reservation_id, ticket_code), "svg")
+    return HttpResponse(svg, content_type=QR_CODE_CONTENT_TYPES["svg"])
+
+
 def ticket_pdf(request, reservation_id: int, ticket_code):
-    from xhtml2pdf import pisa
+    reservation = Reservation.objects.select_related("show__production", "show__venue").get(pk=reservation_id)
+    ticket = reservation.ticket_set.select_related("seat__group").get(ticket_code=ticket_code)
 
-    reservation = Reservation.objects.get(pk=reservation_id)
-    ticket = reservation.ticket_set().get(ticket_code=ticket_code)
+    pdf, key = open_ticket_pdf(reservation, ticket)
+    etag = quote_etag(key)
+    last_modified = int(os.fstat(pdf.fileno()).st_mtime)
 
-    html = TemplateResponse(request, "ticket_detail.html", {
-        "reservation": reservation,
-        "show": reservation.show,
-        "venue": reservation.show.venue,
-        "production": reservation.show.production,
-        "ticket": ticket,
-        "seat": ticket.seat,
-        "qr_code": qr_code_as_png_data_url(request),
-    }, content_type="utf-8").render().content.decode()
-
-    response = HttpResponse(content_type="application/pdf")
-    response["Content-Disposition"] = "inline;filename=karspexet-bokning-{}-{}.pdf".format(reservation_id, ticket_code)
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    if pisa_status.err:
-        raise Exception(pisa_status)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = FileResponse(pdf, content_type="application/pdf")
+        response["Content-Disposition"] = "inline;filename=karspexet-bokning-{}-{}.pdf".format(reservation_id, ticket_code)
+    else:
+        pdf.close()
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
     return response
 
 
 @require_POST
 def cancel_reservation(request, show_id: int):
-    reservation_id = request.session.pop(f"show_{show_id}", None)
-    request.session.pop("reservation_timeout", None)
-    request.session.pop("payment_intent_id", None)
+    reservation_id = forget_reservation(request.session, show_id)
 
-    Reservation.objects.filter(pk=reservation_id).delete()
+    # Paid reservations have tickets, and are not the customer's to cancel
+    Reservation.objects.filter(pk=reservation_id, finalized=False).delete()
     return redirect("ticket_home")
 
 
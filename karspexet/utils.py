@@ -1,5 +1,31 @@
+from django.core.paginator import Paginator
+from django.db import connections
 from django.shortcuts import reverse
+from django.utils.functional import cached_property
 
 
 def admin_change_url(obj) -> str:
     return reverse("admin:%s_%s_change" % (obj._meta.app_label, obj._meta.model_name), args=(obj.pk,))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Takes the number of rows of an unfiltered queryset from the statistics of the planner instead
+    of counting them, which means reading the whole table. Filtered querysets and small tables,
+    whose statistics may be missing or stale, are counted as usual.
+    """
+
+    threshold = 10_000
+
+    @cached_property
+    def count(self) -> int:
+        queryset = self.object_list
+        if not queryset.query.where:
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.threshold:
+                return int(row[0])
+        return super().count
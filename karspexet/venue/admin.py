@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django.contrib.admin.options import IncorrectLookupParameters
+from django.db.models import Count
 from django.shortcuts import redirect
 from django.urls import reverse
 from django.utils.html import format_html
@@ -56,6 +57,7 @@ class PricingModelInline(admin.TabularInline):
 @admin.register(Venue)
 class VenueAdmin(DjangoObjectActions, admin.ModelAdmin):
     inlines = [SeatingGroupInline]
+    list_display = ["name", "num_seats"]
     readonly_fields = ["num_seats"]
 
     change_actions = ["add_seats"]
@@ -64,16 +66,20 @@ class VenueAdmin(DjangoObjectActions, admin.ModelAdmin):
     def add_seats(self, request, obj):
         return redirect("manage_seats", venue_id=obj.id)
 
-    @admin.display(description="Number of seats")
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(num_seats=Count("seatinggroup__seat"))
+
+    @admin.display(description="Number of seats", ordering="num_seats")
     def num_seats(self, obj):
         if not obj:
             return ""
-        return Seat.objects.filter(group__venue=obj).count()
+        return obj.num_seats
 
 
 @admin.register(SeatingGroup)
 class SeatingGroupAdmin(admin.ModelAdmin):
     inlines = [PricingModelInline]
+    list_select_related = ["venue"]
     raw_id_fields = ("venue",)
     readonly_fields = ["seat_admin_link"]
 
@@ -88,5 +94,6 @@ class SeatingGroupAdmin(admin.ModelAdmin):
 @admin.register(Seat)
 class SeatAdmin(admin.ModelAdmin):
     list_display = ("name", "group")
+    list_select_related = ["group__venue"]
     raw_id_fields = ("group",)
     list_filter = [VenueFilter]
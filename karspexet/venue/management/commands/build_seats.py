@@ -1,49 +1,129 @@
 import csv
+import time
+from contextlib import contextmanager
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import ProtectedError
 
-from karspexet.venue.models import Seat, SeatingGroup, Venue
+from karspexet.venue.models import Seat, SeatingGroup, Venue, bump_layout_version
+
+CHUNK_SIZE = 1000
 
 
 class Command(BaseCommand):
+    help = (
+        "Import the seats of a venue from a CSV file with the columns group, x, y and seat name. "
+        "A seat is identified by its group and name, so importing a file again moves the seats "
+        "whose position changed and adds the new ones."
+    )
+
     def add_arguments(self, parser):
         parser.add_argument("venue-id", type=int)
         parser.add_argument("file")
-        parser.add_argument("--clear", action="store_true")
+        parser.add_argument("--clear", action="store_true", help="Delete all seats of the venue before importing")
+        parser.add_argument("--delete-removed", action="store_true", help="Delete the seats missing from the file")
+        parser.add_argument("--dry-run", action="store_true", help="Report the changes without saving them")
 
     def handle(self, *args, **options):
         venue = Venue.objects.get(pk=options["venue-id"])
+        self.timings = {}
+
+        with transaction.atomic():
+            if options["clear"]:
+                with self._phase("clear"):
+                    Seat.objects.filter(group__venue=venue).delete()
+                    SeatingGroup.objects.filter(venue=venue).delete()
+
+            with self._phase("load"):
+                groups = {group.name: group for group in SeatingGroup.objects.filter(venue=venue)}
+                existing, duplicates = {}, []
+                for seat in Seat.objects.filter(group__venue=venue).select_related("group").order_by("id"):
+                    # Earlier imports created a new seat instead of moving it, so keep the oldest one
+                    key = (seat.group.name, seat.name)
+                    if key in existing:
+                        duplicates.append(seat)
+                    else:
+                        existing[key] = seat
+
+            added, moved = [], []
+            seen = set()
+            with self._phase("import"):
+                for rows in _chunks(self._read_file(options["file"]), CHUNK_SIZE):
+                    new_groups = [
+                        SeatingGroup(venue=venue, name=name)
+                        for name in dict.fromkeys(row[0] for row in rows) if name not in groups
+                    ]
+                    for group in SeatingGroup.objects.bulk_create(new_groups):
+                        groups[group.name] = group
+
+                    to_create, to_update = [], []
+                    for group_name, x_pos, y_pos, seat_name in rows:
+                        x_pos, y_pos = int(x_pos), int(y_pos)
+                        key = (group_name, seat_name)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+
+                        seat = existing.get(key)
+                        if seat is None:
+                            to_create.append(Seat(group=groups[group_name], name=seat_name, x_pos=x_pos, y_pos=y_pos))
+                        elif (seat.x_pos, seat.y_pos) != (x_pos, y_pos):
+                            moved.append((key, (seat.x_pos, seat.y_pos), (x_pos, y_pos)))
+                            seat.x_pos, seat.y_pos = x_pos, y_pos
+                            to_update.append(seat)
+
+                    Seat.objects.bulk_create(to_create)
+                    Seat.objects.bulk_update(to_update, ["x_pos", "y_pos"])
+                    added.extend(to_create)
 
-        if options["clear"]:
-            Seat.objects.filter(group__venue=venue).delete()
-            SeatingGroup.objects.filter(venue=venue).delete()
-
-        groupings = {group.name: group for group in SeatingGroup.objects.filter(venue=venue)}
-
-        count = 0
-        for group_name, x_pos, y_pos, seat_name in self._read_file(options["file"]):
-            group = groupings.get(group_name, None)
-            if group is None:
-                group = SeatingGroup.objects.create(
-                    name=group_name,
-                    venue=venue
-                )
-                groupings[group_name] = group
-
-            _, created = Seat.objects.get_or_create(
-                group=group,
-                name=seat_name,
-                x_pos=x_pos,
-                y_pos=y_pos,
-            )
-            if created:
-                count += created
-
-        total = Seat.objects.filter(group__venue=venue).count()
-        self.stdout.write("Created %s new Seats for %s (now has %s)" % (count, venue, total))
+            removed = [seat for key, seat in existing.items() if key not in seen] + duplicates
+            if options["delete_removed"] and removed:
+                with self._phase("delete"):
+                    try:
+                        Seat.objects.filter(id__in=[seat.id for seat in removed]).delete()
+                    except ProtectedError as e:
+                        sold = ", ".join(sorted({str(ticket.seat) for ticket in e.protected_objects}))
+                        raise CommandError(f"Can't delete seats with sold tickets: {sold}") from e
+
+            # Bulk operations don't send the signals that normally invalidate the venue's caches
+            bump_layout_version(venue.id)
+
+            self._report(venue, added, moved, removed, options)
+            if options["dry_run"]:
+                transaction.set_rollback(True)
+
+    def _report(self, venue, added, moved, removed, options):
+        if options["verbosity"] > 1:
+            for seat in added:
+                self.stdout.write(f"+ {seat.group.name}: {seat.name} ({seat.x_pos}, {seat.y_pos})")
+            for (group_name, seat_name), old, new in moved:
+                self.stdout.write(f"~ {group_name}: {seat_name} {old} -> {new}")
+            for seat in removed:
+                self.stdout.write(f"- {seat.group.name}: {seat.name}")
+
+        deleted = "deleted" if options["delete_removed"] else "kept, use --delete-removed to delete them"
+        self.stdout.write(
+            f"Seats of {venue}: {len(added)} added, {len(moved)} moved, {len(removed)} removed ({deleted})"
+        )
+        self.stdout.write("  ".join(f"{phase}={duration:.0f}ms" for phase, duration in self.timings.items()))
+        if options["dry_run"]:
+            self.stdout.write("Dry run, nothing was saved")
+
+    @contextmanager
+    def _phase(self, name):
+        start = time.perf_counter()
+        yield
+        self.timings[name] = (time.perf_counter() - start) * 1000
 
     @staticmethod
     def _read_file(filename):
-        with open(filename) as csv_file:
-            reader = csv.reader(csv_file)
-            return list(reader)
+        with open(filename, newline="") as csv_file:
+            yield from (row for row in csv.reader(csv_file) if row)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.15 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('venue', '0007_alter_venue_seat_map_dimensions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='venue',
+            name='layout_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
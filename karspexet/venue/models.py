@@ -3,6 +3,8 @@ from __future__ import annotations
 from django.contrib.postgres.fields import HStoreField
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models import F, Func
+from django.db.models.functions import Cast
 
 
 def validate_dimensions(value):
@@ -26,10 +28,28 @@ class Venue(models.Model):
     address = models.TextField(blank=True)
     map_address = models.CharField(blank=True, max_length=255)
     seat_map_dimensions = HStoreField(null=False, default=dict, blank=True, validators=[validate_dimensions])
+    layout_version = models.PositiveIntegerField(default=1, editable=False)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # The layout version is only ever bumped in the database, so a save must not write back the loaded one
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != "layout_version"
+            ]
+        super().save(*args, **kwargs)
+
+
+def bump_layout_version(venue_id) -> None:
+    """
+    Mark everything cached from the seat layout and pricing of a venue as outdated
+    """
+    Venue.objects.filter(id=venue_id).update(layout_version=F("layout_version") + 1)
+
 
 class SeatingGroup(models.Model):
     venue = models.ForeignKey(Venue, on_delete=models.CASCADE)
@@ -43,13 +63,37 @@ class SeatingGroup(models.Model):
 
 
 class SeatManager(models.Manager):
-    def available_seats(self, show) -> list[Seat]:
-        taken_seats = set(show.ticket_set.values_list("seat_id", flat=True))
-        reserved_seats = show.reservation_set(manager="active").values_list("tickets", flat=True)
-        for tickets in reserved_seats:
-            taken_seats.update(map(int, tickets.keys()))
-        seats = Seat.objects.filter(group__venue=show.venue).exclude(id__in=taken_seats)
-        return list(seats)
+    def available_seats(self, show, reservation=None) -> list[Seat]:
+        return list(self.filter(id__in=self.available_seat_ids_query(show, reservation)).order_by("id"))
+
+    def available_seat_ids(self, show, reservation=None) -> list[int]:
+        return sorted(self.available_seat_ids_query(show, reservation))
+
+    def available_seat_ids_query(self, show, reservation=None) -> models.QuerySet:
+        """
+        Ids of the seats in the show's venue which are neither sold nor held by an active reservation
+
+        This is one `EXCEPT` statement, where the held seats are the unnested keys of every
+        active reservation's `tickets`, so the set difference is computed by Postgres. The seats held by the given
+        reservation count as available, since it gives them up when it holds new ones.
+        """
+        Reservation = self.model._meta.apps.get_model("ticket", "Reservation")
+        Ticket = self.model._meta.apps.get_model("ticket", "Ticket")
+
+        # Every part selects the same annotation, since Django otherwise replaces the
+        # expression in the later parts with the columns selected by the first one
+        venue_seats = self.filter(group__venue_id=show.venue_id).annotate(seat_number=F("id"))
+        held_seats = Reservation.active.filter(show_id=show.id).annotate(
+            seat_number=Cast(Func(F("tickets"), function="skeys"), output_field=models.IntegerField()),
+        )
+        if reservation is not None:
+            held_seats = held_seats.exclude(pk=reservation.pk)
+        sold_seats = Ticket.objects.filter(show_id=show.id).annotate(seat_number=F("seat_id"))
+
+        return venue_seats.values_list("seat_number", flat=True).difference(
+            held_seats.values_list("seat_number", flat=True),
+            sold_seats.values_list("seat_number", flat=True),
+        )
 
 
 class Seat(models.Model):
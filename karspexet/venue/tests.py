@@ -1,8 +1,18 @@
+import csv
+import io
+import os
+from datetime import timedelta
+
+import pytest
+from django.core.management import CommandError, call_command
+from django.db import connection
 from django.shortcuts import reverse
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
 from factories import factories as f
-from karspexet.venue.models import Seat
+from karspexet.venue.models import Seat, SeatingGroup, Venue, bump_layout_version
 
 
 class TestVenueViews(TestCase):
@@ -21,3 +31,152 @@ class TestVenueViews(TestCase):
         response = self.client.post(url, data={"group": group.id, "num_seats": 2})
         assert response.status_code == 302
         assert Seat.objects.count() == 2
+
+    def test_manage_seats_lays_out_a_grid_in_one_insert(self):
+        venue = f.CreateVenue()
+        group = f.CreateSeatingGroup(venue=venue)
+        f.CreateSeat(group=group, name="Plats 1")
+        layout_version = Venue.objects.get(pk=venue.pk).layout_version
+
+        url = reverse("manage_seats", args=[venue.id])
+        data = {"group": group.id, "num_seats": 300, "columns": 20, "spacing": 25, "x_pos": 10, "y_pos": 100}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data=data)
+        assert response.status_code == 302
+
+        assert len([q for q in queries if q["sql"].startswith("INSERT INTO \"venue_seat\"")]) == 1
+        seats = list(Seat.objects.filter(group=group).order_by("id")[1:])
+        assert len(seats) == 300
+        assert (seats[0].name, seats[0].x_pos, seats[0].y_pos) == ("Plats 2", 10, 100)
+        assert (seats[21].name, seats[21].x_pos, seats[21].y_pos) == ("Plats 23", 35, 125)
+        assert seats[-1].name == "Plats 301"
+        assert Venue.objects.get(pk=venue.pk).layout_version > layout_version
+
+    def test_manage_seats_spaces_a_grid_by_default(self):
+        venue = f.CreateVenue()
+        group = f.CreateSeatingGroup(venue=venue)
+
+        url = reverse("manage_seats", args=[venue.id])
+        data = {"group": group.id, "num_seats": 3, "columns": 2, "spacing": "", "x_pos": 0, "y_pos": 0}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, data=data)
+
+        # The groups listed on the page are not loaded for a POST
+        assert not [q for q in queries if "GROUP BY" in q["sql"]]
+        positions = list(Seat.objects.filter(group=group).order_by("id").values_list("x_pos", "y_pos"))
+        assert positions == [(0, 0), (30, 0), (0, 30)]
+
+    def test_manage_seats_rejects_groups_of_other_venues(self):
+        venue = f.CreateVenue()
+        other_group = f.CreateSeatingGroup()
+
+        url = reverse("manage_seats", args=[venue.id])
+        response = self.client.post(url, data={"group": other_group.id, "num_seats": 2})
+        assert response.status_code == 404
+        assert Seat.objects.count() == 0
+
+
+class TestVenue(TestCase):
+    def test_saving_keeps_the_layout_version_bumped_meanwhile(self):
+        venue = f.CreateVenue()
+        stale = Venue.objects.get(pk=venue.pk)
+        bump_layout_version(venue.pk)
+        bumped = Venue.objects.get(pk=venue.pk).layout_version
+
+        stale.name = "Aulan"
+        stale.save()
+
+        saved = Venue.objects.get(pk=venue.pk)
+        assert saved.name == "Aulan"
+        assert saved.layout_version > bumped
+
+
+class TestSeatManager(TestCase):
+    def test_available_seats_excludes_sold_and_held_seats(self):
+        show = f.CreateShow(venue__num_seats=4)
+        sold, held, expired, free = Seat.objects.order_by("id")
+        f.CreateTicket(show=show, seat=sold)
+        f.CreateReservation(show=show, tickets={str(held.id): "normal"}, session_timeout=timezone.now() + timedelta(minutes=5))
+        f.CreateReservation(show=show, tickets={str(expired.id): "normal"}, session_timeout=timezone.now() - timedelta(minutes=5))
+        f.CreateTicket(seat=free)  # Sold for another show
+
+        assert Seat.objects.available_seats(show) == [expired, free]
+        assert Seat.objects.available_seat_ids(show) == [expired.id, free.id]
+
+    def test_available_seats_include_the_seats_of_the_given_reservation(self):
+        show = f.CreateShow(venue__num_seats=2)
+        held, free = Seat.objects.order_by("id")
+        reservation = f.CreateReservation(
+            show=show, tickets={str(held.id): "normal"}, session_timeout=timezone.now() + timedelta(minutes=5)
+        )
+
+        assert Seat.objects.available_seats(show, reservation) == [held, free]
+
+
+class TestBuildSeats(TestCase):
+    @pytest.fixture(autouse=True)
+    def _tmp_dir(self, tmp_path):
+        self.tmp_dir = tmp_path
+
+    def setUp(self):
+        self.venue = f.CreateVenue()
+
+    def _build_seats(self, rows, *args):
+        path = os.path.join(self.tmp_dir, "seats.csv")
+        with open(path, "w", newline="") as csv_file:
+            csv.writer(csv_file).writerows(rows)
+        out = io.StringIO()
+        call_command("build_seats", str(self.venue.id), path, *args, stdout=out)
+        return out.getvalue()
+
+    def _seats(self):
+        seats = Seat.objects.filter(group__venue=self.venue)
+        return sorted(seats.values_list("group__name", "name", "x_pos", "y_pos"))
+
+    def test_imports_seats_in_bulk(self):
+        rows = [[f"Sektion {i // 100}", i, 0, f"Plats {i}"] for i in range(300)]
+
+        with CaptureQueriesContext(connection) as queries:
+            output = self._build_seats(rows)
+
+        assert len(queries) < 20
+        assert len(self._seats()) == 300
+        assert SeatingGroup.objects.filter(venue=self.venue).count() == 3
+        assert "300 added, 0 moved, 0 removed" in output
+
+    def test_reimport_moves_adds_and_removes_seats(self):
+        self._build_seats([["Parkett", 0, 0, "1"], ["Parkett", 10, 0, "2"], ["Parkett", 20, 0, "3"]])
+        layout_version = Venue.objects.get(pk=self.venue.pk).layout_version
+
+        output = self._build_seats([["Parkett", 0, 0, "1"], ["Parkett", 15, 5, "2"], ["Balkong", 0, 50, "1"]])
+
+        assert "1 added, 1 moved, 1 removed" in output
+        assert self._seats() == [
+            ("Balkong", "1", 0, 50),
+            ("Parkett", "1", 0, 0),
+            ("Parkett", "2", 15, 5),
+            ("Parkett", "3", 20, 0),
+        ]
+        assert Venue.objects.get(pk=self.venue.pk).layout_version > layout_version
+
+        self._build_seats([["Parkett", 0, 0, "1"]], "--delete-removed")
+        assert self._seats() == [("Parkett", "1", 0, 0)]
+
+    def test_dry_run_reports_changes_without_saving(self):
+        self._build_seats([["Parkett", 0, 0, "1"], ["Parkett", 10, 0, "2"]])
+
+        output = self._build_seats([["Parkett", 5, 0, "1"], ["Parkett", 20, 0, "3"]], "--dry-run", "--verbosity=2")
+
+        assert "+ Parkett: 3 (20, 0)" in output
+        assert "~ Parkett: 1 (0, 0) -> (5, 0)" in output
+        assert "- Parkett: 2" in output
+        assert "Dry run" in output
+        assert self._seats() == [("Parkett", "1", 0, 0), ("Parkett", "2", 10, 0)]
+
+    def test_refuses_to_delete_sold_seats(self):
+        self._build_seats([["Parkett", 0, 0, "1"], ["Parkett", 10, 0, "2"]])
+        f.CreateTicket(seat=Seat.objects.get(name="2"))
+
+        with pytest.raises(CommandError, match="sold tickets"):
+            self._build_seats([["Parkett", 0, 0, "1"]], "--delete-removed")
+        assert len(self._seats()) == 2
@@ -5,18 +5,39 @@ import logging
 from django import forms
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import transaction
 from django.db.models import Count
 from django.http import Http404, HttpRequest, HttpResponse
-from django.shortcuts import redirect, render
+from django.shortcuts import get_object_or_404, redirect, render
 
-from karspexet.venue.models import Seat, SeatingGroup, Venue
+from karspexet.venue.models import Seat, SeatingGroup, Venue, bump_layout_version
 
 logger = logging.getLogger(__name__)
 
+# Distance between the seats of a grid, when the staff leave it out
+DEFAULT_SEAT_SPACING = 30
+
 
 class AddSeatsForm(forms.Form):
-    num_seats = forms.IntegerField(min_value=1)
+    num_seats = forms.IntegerField(min_value=1, max_value=2000)
     group = forms.IntegerField(widget=forms.HiddenInput)
+    columns = forms.IntegerField(min_value=1, required=False)
+    spacing = forms.IntegerField(min_value=1, required=False, initial=DEFAULT_SEAT_SPACING)
+    x_pos = forms.IntegerField(required=False, initial=0)
+    y_pos = forms.IntegerField(required=False, initial=0)
+
+
+def seat_grid(num_seats: int, columns: int | None, spacing: int, x_pos: int, y_pos: int):
+    """
+    Positions of `num_seats` seats laid out row by row with `columns` seats per row, starting
+    at (x_pos, y_pos). Without columns every seat is placed on the starting position.
+    """
+    for i in range(num_seats):
+        if columns:
+            row, column = divmod(i, columns)
+            yield x_pos + column * spacing, y_pos + row * spacing
+        else:
+            yield x_pos, y_pos
 
 
 @staff_member_required
@@ -28,27 +49,37 @@ def manage_seats(request: HttpRequest, venue_id: int) -> HttpResponse:
     if not venue:
         raise Http404
 
-    group_qs = SeatingGroup.objects.filter(venue=venue).annotate(num_seats=Count("seat"))
-    groups: list[SeatingGroup] = list(group_qs)
-
     if request.method == "POST":
         form = AddSeatsForm(data=request.POST)
-        form.is_valid()
         if form.is_valid():
-            group = form.cleaned_data["group"]
-            num_seats = form.cleaned_data["num_seats"]
-            for i in range(num_seats):
-                number = Seat.objects.filter(group__venue=venue).count() + 1
-                seat = Seat.objects.create(
-                    group_id=group,
-                    name="Plats %s" % number,
-                    x_pos=0,
-                    y_pos=0,
+            data = form.cleaned_data
+            group = get_object_or_404(SeatingGroup, id=data["group"], venue=venue)
+            with transaction.atomic():
+                # Numbering continues from the seats of the whole venue, so other staff adding seats
+                # at the same time must wait until these are saved
+                Venue.objects.select_for_update().filter(id=venue.id).first()
+                number = Seat.objects.filter(group__venue=venue).count()
+                positions = seat_grid(
+                    data["num_seats"],
+                    data["columns"],
+                    data["spacing"] or DEFAULT_SEAT_SPACING,
+                    data["x_pos"] or 0,
+                    data["y_pos"] or 0,
                 )
-                logger.info("Created %s - %s", venue.name, seat.name)
-            messages.success(request, f"Skapade {num_seats} extra sittplatser")
+                Seat.objects.bulk_create(
+                    Seat(group=group, name="Plats %s" % (number + i), x_pos=x, y_pos=y)
+                    for i, (x, y) in enumerate(positions, start=1)
+                )
+                # bulk_create doesn't send the signals that otherwise mark the seat map as changed
+                bump_layout_version(venue.id)
+            logger.info("Created %d seats in %s - %s", data["num_seats"], venue.name, group.name)
+            messages.success(request, f"Skapade {data['num_seats']} extra sittplatser")
+        else:
+            messages.error(request, "Kunde inte skapa sittplatserna: %s" % form.errors.as_text())
         return redirect("manage_seats", venue_id=venue.id)
 
+    group_qs = SeatingGroup.objects.filter(venue=venue).annotate(num_seats=Count("seat")).prefetch_related("seat_set")
+    groups: list[SeatingGroup] = list(group_qs)
     return render(request, "venue/manage_seats.html", {
         "venue": venue,
         "groups": groups,